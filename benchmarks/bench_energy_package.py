@@ -0,0 +1,79 @@
+"""
+Benchmarks of the energy_package hot paths.
+
+Run with
+
+    pytest benchmarks --benchmark-json=benchmarks.json
+
+and compare two saved runs with `pytest-benchmark compare`.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import energy_package as ep
+
+from conftest import make_hamiltonian
+
+GRAPHS = ["ring", "lattice", "regular"]
+
+
+@pytest.mark.parametrize("N", [64, 1024, 16384])
+def bench_bitstring_flip(benchmark, N):
+    bs = ep.BitString(N)
+    bs.config
+    benchmark(bs.flip_site, N // 2)
+
+
+@pytest.mark.parametrize("N", [64, 1024, 16384])
+def bench_bitstring_on(benchmark, N):
+    bs = ep.BitString(N).set_integer_config(2**N // 3)
+    benchmark(bs.on)
+
+
+@pytest.mark.parametrize("N", [64, 1024, 16384])
+def bench_bitstring_integer(benchmark, N):
+    bs = ep.BitString(N)
+    benchmark(lambda: bs.set_integer_config(2**N // 3).integer())
+
+
+@pytest.mark.parametrize("kind", GRAPHS)
+@pytest.mark.parametrize("N", [100, 1000, 10000])
+def bench_energy(benchmark, kind, N):
+    ham = make_hamiltonian(kind, N)
+    bs = ep.BitString(ham.N).set_config(np.random.default_rng(0).integers(0, 2, ham.N))
+    ham.energy(bs)
+    benchmark(ham.energy, bs)
+
+
+@pytest.mark.parametrize("kind", GRAPHS)
+@pytest.mark.parametrize("N", [100, 1000, 10000])
+def bench_delta_e(benchmark, kind, N):
+    ham = make_hamiltonian(kind, N)
+    bs = ep.BitString(ham.N).set_config(np.random.default_rng(0).integers(0, 2, ham.N))
+    ham.delta_e(bs, 0)
+    benchmark(ham.delta_e, bs, ham.N // 2)
+
+
+@pytest.mark.parametrize("kind", GRAPHS)
+@pytest.mark.parametrize("N", [12, 16, 20])
+def bench_compute_average_values(benchmark, kind, N):
+    ham = make_hamiltonian(kind, N)
+    ham.couplings
+    result = benchmark(ham.compute_average_values, 2.0, method="enumerate")
+    benchmark.extra_info["states_per_second"] = 2**ham.N / benchmark.stats.stats.mean
+    assert np.all(np.isfinite(result))
+
+
+@pytest.mark.parametrize("mode", ["sequential", "checkerboard", "swendsen-wang"])
+@pytest.mark.parametrize("kind", GRAPHS)
+@pytest.mark.parametrize("N", [100, 1000, 10000])
+def bench_montecarlo_sweeps(benchmark, mode, kind, N):
+    ham = make_hamiltonian(kind, N)
+    mc = ep.MonteCarlo(ham, seed=0)
+    n_sweeps = 10
+    mc.run(2.0, 1, 0, mode=mode)
+    benchmark.pedantic(mc.run, args=(2.0, n_sweeps, 0), kwargs={"mode": mode}, rounds=3)
+    benchmark.extra_info["sweeps_per_second"] = n_sweeps / benchmark.stats.stats.mean
@@ -0,0 +1,32 @@
+"""
+Graph builders shared by the benchmarks.
+"""
+
+import numpy as np
+import networkx as nx
+
+import energy_package as ep
+
+
+def make_graph(kind, N, Jval=-1.0):
+    """Build a ring, periodic 2D lattice or random 3-regular graph with about N sites"""
+    if kind == "ring":
+        G = nx.cycle_graph(N)
+    elif kind == "lattice":
+        L = int(round(np.sqrt(N)))
+        G = nx.convert_node_labels_to_integers(nx.grid_2d_graph(L, N // L, periodic=True))
+    elif kind == "regular":
+        G = nx.random_regular_graph(3, N + N % 2, seed=0)
+    else:
+        raise ValueError(kind)
+    for e in G.edges:
+        G.edges[e]['weight'] = Jval
+    return G
+
+
+def make_hamiltonian(kind, N):
+    """Build a hamiltonian with a small uniform field on a benchmark graph"""
+    G = make_graph(kind, N)
+    ham = ep.IsingHamiltonian(G)
+    ham.set_mu(np.full(len(G), .1))
+    return ham
@@ -2,6 +2,21 @@
 
 # Add imports here
 from .functions import *
+from .couplings import *
+from .exact import *
+from .transfer_matrix import *
+from .elimination import *
+from .symmetry import *
+from .analysis import *
+from .clusters import *
+from .accumulators import *
+from .random_blocks import *
+from .observers import *
+from .checkpoint import *
+from .wang_landau import *
+from .lattice import *
+from .stencil import *
+from .kernels import available_backends, get_backend, set_backend
 
 
 from ._version import __version__
@@ -0,0 +1,210 @@
+import numpy as np
+
+
+class Welford:
+    """
+    Online mean and variance of a stream of values, Welford's algorithm
+    """
+
+    def __init__(self):
+        """
+        Start with an empty stream
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, values):
+        """
+        Add a single value or an array of values
+
+        Parameters
+        ----------
+        values  : float or np.ndarray
+            new values of the stream
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        n = len(values)
+        if n == 0:
+            return self
+
+        # Chan et al. merge of the batch into the running moments
+        mean = values.mean()
+        m2 = np.dot(values - mean, values - mean)
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        return self
+
+    @property
+    def variance(self):
+        """
+        Sample variance of the stream, nan with fewer than two values
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def stderr(self):
+        """
+        Standard error of the mean, assuming uncorrelated values
+        """
+        return np.sqrt(self.variance / self.count) if self.count > 1 else np.nan
+
+
+class BinningAccumulator:
+    """
+    Online binning (blocking) analysis of a correlated stream
+
+    Level k keeps the running statistics of the means of blocks of 2^k
+    consecutive values, so the standard error at a high enough level
+    accounts for autocorrelation without storing the stream.
+    """
+
+    def __init__(self, min_blocks: int = 32):
+        """
+        Start with an empty stream
+
+        Parameters
+        ----------
+        min_blocks  : int
+            fewest blocks a level needs for its error to be trusted
+        """
+        self.min_blocks = min_blocks
+        self.levels = []
+        self.pending = []
+
+    def add(self, values):
+        """
+        Add a single value or an array of values
+
+        Parameters
+        ----------
+        values  : float or np.ndarray
+            new values of the stream
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        level = 0
+        while len(values):
+            if level == len(self.levels):
+                self.levels.append(Welford())
+                self.pending.append(None)
+            self.levels[level].add(values)
+
+            # Pair up consecutive values, carrying an odd one over to the next call
+            if self.pending[level] is not None:
+                values = np.concatenate([[self.pending[level]], values])
+                self.pending[level] = None
+            if len(values) % 2:
+                self.pending[level] = values[-1]
+                values = values[:-1]
+            values = (values[0::2] + values[1::2]) / 2
+            level += 1
+        return self
+
+    @property
+    def mean(self):
+        """
+        Mean of the stream
+        """
+        return self.levels[0].mean if self.levels else np.nan
+
+    def stderr_levels(self):
+        """
+        Return the standard error estimated at every binning level
+
+        Returns
+        -------
+        errors : np.ndarray
+            standard error of the mean from blocks of 2^k values, for every k
+        """
+        return np.array([level.stderr for level in self.levels])
+
+    @property
+    def stderr(self):
+        """
+        Standard error of the mean from the highest level with at least `min_blocks` blocks
+        """
+        errors = [level.stderr for level in self.levels if level.count >= self.min_blocks]
+        return errors[-1] if errors else np.nan
+
+
+class SampleAccumulator:
+    """
+    Streaming statistics of Monte Carlo energy and magnetization samples
+
+    Keeps the moments of E, M and |M| with binned error estimates, so the
+    averages of `run` are available in constant memory.
+    """
+
+    def __init__(self, T: float):
+        """
+        Start with no samples
+
+        Parameters
+        ----------
+        T   : float
+            temperature of the samples, used for heat capacity and susceptibility
+        """
+        self.T = T
+        self.E = BinningAccumulator()
+        self.M = BinningAccumulator()
+        self.abs_M = Welford()
+
+    def add(self, E, M):
+        """
+        Add samples
+
+        Parameters
+        ----------
+        E   : float or np.ndarray
+            energy samples
+        M   : float or np.ndarray
+            magnetization samples
+        """
+        self.E.add(E)
+        self.M.add(M)
+        self.abs_M.add(np.abs(M))
+        return self
+
+    @property
+    def count(self):
+        """
+        Number of samples added
+        """
+        return self.abs_M.count
+
+    def averages(self):
+        """
+        Return average energy, magnetization, heat capacity, and
+        magnetic susceptibility of the samples
+
+        Returns
+        -------
+        E  : float
+            Average energy
+        M  : float
+            Average magnetization
+        HC  : float
+            Heat capacity, the variance of E over T^2
+        MS  : float
+            Magnetic susceptibility, the variance of M over T, all four NaN without samples
+        """
+        if self.count == 0:
+            return (np.nan,) * 4
+        E, M = self.E.levels[0], self.M.levels[0]
+        return E.mean, M.mean, E.m2 / E.count * self.T ** -2, M.m2 / M.count * self.T ** -1
+
+    def errors(self):
+        """
+        Return binned standard errors of the average energy and magnetization
+
+        Returns
+        -------
+        dE  : float
+            standard error of the average energy
+        dM  : float
+            standard error of the average magnetization
+        """
+        return self.E.stderr, self.M.stderr
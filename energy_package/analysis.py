@@ -0,0 +1,407 @@
+import numpy as np
+
+from .exact import DensityOfStates, _compress_histogram
+
+
+def gelman_rubin(traces):
+    """
+    Return the Gelman-Rubin potential scale reduction factor R-hat
+
+    Parameters
+    ----------
+    traces  : np.ndarray
+        2D array with one chain per row, all of equal length
+
+    Returns
+    -------
+    rhat : float
+        R-hat of the chains, close to 1 when they agree, nan for a single
+        chain or chains without variance
+    """
+    traces = np.asarray(traces, dtype=float)
+    m, n = traces.shape
+    if m < 2 or n < 2:
+        return np.nan
+
+    means = traces.mean(axis=1)
+    B = n * means.var(ddof=1)
+    W = traces.var(axis=1, ddof=1).mean()
+    if W == 0:
+        return np.nan
+
+    return np.sqrt(((n - 1) / n * W + B / n) / W)
+
+
+class ChainResults:
+    """
+    Class to hold the traces of several independent Monte Carlo chains and their merged statistics
+    """
+
+    def __init__(self, E, M):
+        """
+        Store the traces and compute merged means, standard errors and R-hat
+
+        Parameters
+        ----------
+        E   : array_like
+            energy trace of every chain, one chain per row
+        M   : array_like
+            magnetization trace of every chain, one chain per row
+        """
+        self.E = np.atleast_2d(np.asarray(E, dtype=float))
+        self.M = np.atleast_2d(np.asarray(M, dtype=float))
+        self.n_chains = len(self.E)
+
+        self.mean_E, self.stderr_E = self._merge(self.E)
+        self.mean_M, self.stderr_M = self._merge(self.M)
+        self.rhat_E = gelman_rubin(self.E)
+        self.rhat_M = gelman_rubin(self.M)
+
+    def _merge(self, traces):
+        """
+        Return the mean over all chains and its standard error, taken from
+        the spread of the chain means so it accounts for autocorrelation
+        """
+        if traces.shape[1] == 0:
+            return np.nan, np.nan
+        if self.n_chains < 2:
+            return traces.mean(), traces.std(ddof=1) / np.sqrt(traces.size) if traces.size > 1 else np.nan
+        means = traces.mean(axis=1)
+        return means.mean(), means.std(ddof=1) / np.sqrt(self.n_chains)
+
+
+class TemperingResults:
+    """
+    Class to hold per-temperature traces and swap statistics of a parallel tempering run
+    """
+
+    def __init__(self, temperatures, E, M, swap_acceptance):
+        """
+        Store the traces and per-temperature means
+
+        Parameters
+        ----------
+        temperatures    : array_like
+            temperature ladder, lowest first
+        E               : array_like
+            energy trace at every temperature, one temperature per row
+        M               : array_like
+            magnetization trace at every temperature, one temperature per row
+        swap_acceptance : array_like
+            fraction of accepted swaps between neighboring temperatures
+        """
+        self.temperatures = np.asarray(temperatures, dtype=float)
+        self.E = np.asarray(E, dtype=float).reshape(len(self.temperatures), -1)
+        self.M = np.asarray(M, dtype=float).reshape(len(self.temperatures), -1)
+        self.swap_acceptance = np.asarray(swap_acceptance, dtype=float)
+
+        empty = np.full(len(self.temperatures), np.nan)
+        self.mean_E = self.E.mean(axis=1) if self.E.shape[1] else empty
+        self.mean_M = self.M.mean(axis=1) if self.M.shape[1] else empty.copy()
+
+
+def autocorrelation(trace):
+    """
+    Return the normalized autocorrelation function of a trace, computed by FFT
+
+    Parameters
+    ----------
+    trace   : array_like
+        samples in the order they were drawn
+
+    Returns
+    -------
+    rho : np.ndarray
+        autocorrelation at every lag 0 ... n-1, rho[0] = 1, or nan for a trace without variance
+    """
+    x = np.asarray(trace, dtype=float)
+    n = len(x)
+    if n == 0:
+        return np.zeros(0)
+    x = x - x.mean()
+
+    # Zero padding to a power of two of at least 2n avoids the circular wrap-around
+    size = 1 << (2 * n - 1).bit_length()
+    f = np.fft.rfft(x, size)
+    acov = np.fft.irfft(f * np.conj(f), size)[:n]
+    if acov[0] == 0:
+        return np.full(n, np.nan)
+    return acov / acov[0]
+
+
+def integrated_autocorrelation_time(trace, c: float = 5.0):
+    """
+    Return the integrated autocorrelation time tau = 1 + 2 sum_t rho(t)
+
+    The sum is cut at the smallest window W >= c tau(W) (Sokal's automatic
+    windowing), which trades the bias of a short window against the noise of
+    a long one. Estimates are reliable when the trace is much longer than tau.
+    Anticorrelated traces can give tau < 1, it is floored at 1 so that the
+    effective sample size never exceeds the number of samples and the
+    errors stay conservative.
+
+    Parameters
+    ----------
+    trace   : array_like
+        samples in the order they were drawn
+    c       : float
+        window size in units of tau
+
+    Returns
+    -------
+    tau : float
+        integrated autocorrelation time in samples, 1 for a trace without variance
+    """
+    rho = autocorrelation(trace)
+    if len(rho) == 0 or np.isnan(rho[0]):
+        return 1.0
+
+    taus = 2 * np.cumsum(rho) - 1
+    short = np.arange(len(taus)) < c * taus
+    W = np.argmin(short) if not short.all() else len(taus) - 1
+    return max(taus[W], 1.0)
+
+
+def effective_sample_size(trace, c: float = 5.0):
+    """
+    Return the number of independent samples a correlated trace is worth
+
+    Parameters
+    ----------
+    trace   : array_like
+        samples in the order they were drawn
+    c       : float
+        window size of the autocorrelation time, see integrated_autocorrelation_time
+
+    Returns
+    -------
+    ess : float
+        length of the trace over its integrated autocorrelation time
+    """
+    return len(trace) / integrated_autocorrelation_time(trace, c)
+
+
+def detect_equilibration(trace, n_candidates: int = 50):
+    """
+    Return the number of initial samples to discard as burn-in
+
+    Every candidate start t0 in the first half of the trace is scored by the
+    effective sample size of trace[t0:], and the start keeping the most
+    effective samples is chosen: discarding the initial transient removes
+    the slow decay it adds to the autocorrelation, until discarding more
+    only throws samples away.
+
+    Parameters
+    ----------
+    trace           : array_like
+        samples in the order they were drawn, from the start of the run
+    n_candidates    : int
+        number of candidate starts tried
+
+    Returns
+    -------
+    n_burn : int
+        number of samples to discard
+    """
+    trace = np.asarray(trace, dtype=float)
+    candidates = np.unique(np.linspace(0, len(trace) // 2, n_candidates).astype(np.int64))
+    ess = [effective_sample_size(trace[t0:]) for t0 in candidates]
+    return int(candidates[np.argmax(ess)])
+
+
+class SampleAnalysis:
+    """
+    Class to hold the autocorrelation analysis of the energy and magnetization trace of a run
+    """
+
+    def __init__(self, E, M, T: float, n_burn: int = None):
+        """
+        Discard the burn-in and compute averages with autocorrelation-corrected errors
+
+        Parameters
+        ----------
+        E       : array_like
+            energy trace, from the start of the run
+        M       : array_like
+            magnetization trace, from the start of the run
+        T       : float
+            temperature of the run
+        n_burn  : int, optional
+            number of samples to discard, detected from both traces by default
+        """
+        E = np.asarray(E, dtype=float)
+        M = np.asarray(M, dtype=float)
+        if n_burn is None:
+            n_burn = max(detect_equilibration(E), detect_equilibration(M))
+        self.T = T
+        self.n_burn = n_burn
+        self.E = E[n_burn:]
+        self.M = M[n_burn:]
+
+        self.tau_E = integrated_autocorrelation_time(self.E)
+        self.tau_M = integrated_autocorrelation_time(self.M)
+        self.ess_E = len(self.E) / self.tau_E
+        self.ess_M = len(self.M) / self.tau_M
+
+        # Heat capacity and susceptibility are means of the squared deviations
+        series = [self.E, self.M] + [(x - x.mean()) ** 2 / T ** power if len(x) else x
+                                     for x, power in ((self.E, 2), (self.M, 1))]
+        self.averages = tuple(float(x.mean()) if len(x) else np.nan for x in series)
+        self.errors = tuple(float(np.sqrt(x.var() * integrated_autocorrelation_time(x) / len(x))) if len(x) > 1
+                            else np.nan for x in series)
+
+    def meets(self, target_errors, min_ess: float = 50):
+        """
+        Return whether the errors are within the targets and the traces are
+        long enough for the error estimates to be trusted
+
+        Parameters
+        ----------
+        target_errors   : sequence
+            largest acceptable standard error of E, M, HC and MS, None for no target
+        min_ess         : float
+            fewest effective samples of E and M for the errors to be trusted
+
+        Returns
+        -------
+        met : bool
+            True when every target is met
+        """
+        if min(self.ess_E, self.ess_M) < min_ess:
+            return False
+        return all(target is None or error <= target for error, target in zip(self.errors, target_errors))
+
+
+def _logsumexp(x, axis=None):
+    """
+    Return log(sum(exp(x))) along an axis without overflow
+    """
+    shift = np.max(x, axis=axis, keepdims=True)
+    shift[~np.isfinite(shift)] = 0
+    return np.squeeze(shift, axis=axis) + np.log(np.exp(x - shift).sum(axis=axis))
+
+
+class HistogramReweighting(DensityOfStates):
+    """
+    Density of states estimated from Monte Carlo samples at one or more temperatures
+
+    Samples of the runs are merged into a joint (E, M) histogram and the
+    multiple histogram (Ferrenberg-Swendsen, WHAM) equations
+        g(E) = H(E) / sum_k N_k exp(-E/T_k - log Z_k)
+        Z_k = sum_E g(E) exp(-E/T_k)
+    are solved self-consistently, so the estimate reweights to any temperature
+    (and field) through the DensityOfStates methods. With a single run this
+    is single histogram reweighting. The estimate is only reliable where the
+    sampled energies still carry weight, see `effective_samples`.
+
+    The density of states, and so log_partition, is known only up to a constant.
+    """
+
+    def __init__(self, temperatures, E, M, tol: float = 1e-10, max_iterations: int = 100000, decimals: int = 10):
+        """
+        Merge the samples and solve the reweighting equations
+
+        Parameters
+        ----------
+        temperatures    : float or array_like
+            temperature of every run
+        E               : array_like
+            energy samples of every run, one trace per run (or a single trace)
+        M               : array_like
+            magnetization samples of every run, one trace per run (or a single trace)
+        tol             : float
+            convergence tolerance of the log partition functions
+        max_iterations  : int
+            most self-consistent iterations
+        decimals        : int
+            energies are rounded to this many decimals before they are binned
+        """
+        self.temperatures = np.atleast_1d(np.asarray(temperatures, dtype=float))
+        if np.ndim(self.temperatures) == 1 and len(self.temperatures) == 1 and np.ndim(E[0]) == 0:
+            E, M = [E], [M]
+        E = [np.round(np.asarray(e, dtype=float), decimals) for e in E]
+        M = [np.asarray(m, dtype=float) for m in M]
+        self.n_samples = np.array([len(e) for e in E], dtype=float)
+
+        all_E, all_M = np.concatenate(E), np.concatenate(M)
+        N = int(np.abs(all_M).max()) if len(all_M) else 0
+        energies, mags, counts = _compress_histogram(all_E, all_M.astype(np.int64), np.ones(len(all_E)), N)
+        levels, level_index = np.unique(energies, return_inverse=True)
+        level_counts = np.bincount(level_index, weights=counts)
+
+        # Self-consistent solution for log Z_k, fixed to 0 at the first run
+        beta = 1 / self.temperatures
+        log_n = np.log(self.n_samples)
+        self.log_Z = np.zeros(len(beta))
+        for iteration in range(max_iterations):
+            log_denominator = _logsumexp(log_n - np.outer(levels, beta) - self.log_Z, axis=1)
+            log_Z = _logsumexp(np.log(level_counts) - np.outer(beta, levels) - log_denominator, axis=1)
+            log_Z -= log_Z[0]
+            change = np.abs(log_Z - self.log_Z).max()
+            self.log_Z = log_Z
+            if change < tol:
+                break
+        log_denominator = _logsumexp(log_n - np.outer(levels, beta) - self.log_Z, axis=1)
+
+        self.energies = energies
+        self.magnetizations = mags
+        self.log_histogram = np.log(counts)
+        self.log_counts = self.log_histogram - log_denominator[level_index]
+        # counts are scaled to the largest entry, the absolute scale of g is unknown
+        self.counts = np.exp(self.log_counts - self.log_counts.max())
+
+        # Overlap of the energy histograms of runs adjacent in temperature
+        order = np.argsort(self.temperatures)
+        hists = [np.histogram(E[k], bins=np.append(levels, np.inf))[0] / max(len(E[k]), 1) for k in order]
+        self.overlap = np.array([np.minimum(a, b).sum() for a, b in zip(hists[:-1], hists[1:])])
+
+    def effective_samples(self, T, h=0.0):
+        """
+        Return the effective number of samples behind the reweighted averages
+
+        Kish's estimate (sum w)^2 / sum w^2 over the reweighting factors of
+        the samples, which drops towards 1 when a few samples dominate, that
+        is when T is outside the range covered by the histograms.
+
+        Parameters
+        ----------
+        T   : float or np.ndarray
+            temperatures to compute at
+        h   : float or np.ndarray
+            additional uniform field, broadcast against T
+
+        Returns
+        -------
+        n_eff : float or np.ndarray
+            effective number of samples at every (T, h)
+        """
+        T, h = np.broadcast_arrays(np.asarray(T, dtype=float), np.asarray(h, dtype=float))
+        n_eff = np.zeros(T.size)
+
+        for rows, energies, log_weights in self._log_weights(T.ravel(), h.ravel()):
+            # per-sample factors are the weight of the entry over its number of samples
+            log_factors = log_weights - self.log_histogram
+            n_eff[rows] = np.exp(2 * _logsumexp(log_weights, axis=1)
+                                 - _logsumexp(log_factors + log_weights, axis=1))
+
+        return n_eff.reshape(T.shape)[()]
+
+    def reliable(self, T, h=0.0, min_samples: float = 100):
+        """
+        Return whether the reweighted averages at T rest on enough samples
+
+        Parameters
+        ----------
+        T           : float or np.ndarray
+            temperatures to compute at
+        h           : float or np.ndarray
+            additional uniform field, broadcast against T
+        min_samples : float
+            fewest effective samples for the averages to be trusted
+
+        Returns
+        -------
+        ok : bool or np.ndarray
+            True where the effective number of samples reaches min_samples
+        """
+        return self.effective_samples(T, h) >= min_samples
@@ -0,0 +1,145 @@
+import os
+import pickle
+
+import numpy as np
+
+
+class Checkpoint:
+    """
+    Class to hold the state of an interrupted Monte Carlo run
+
+    Stores the run settings, the sweep counter, the current configuration,
+    the random stream (generator and unused pre-drawn numbers), the
+    streaming accumulators and the number of samples already written to the
+    output file, so that the run continues exactly where it stopped.
+    """
+
+    def __init__(self, settings: dict, sweep: int, config, random, stats, n_written: int = 0):
+        """
+        Collect the state of a run
+
+        Parameters
+        ----------
+        settings    : dict
+            arguments of the run (T, n_samples, n_burn, mode, ...)
+        sweep       : int
+            number of sweeps completed
+        config      : BitString
+            current configuration
+        random      : RandomBlocks
+            random stream of the run
+        stats       : SampleAccumulator
+            streaming statistics of the samples kept so far
+        n_written   : int
+            number of samples written to the output file
+        """
+        self.settings = settings
+        self.sweep = sweep
+        self.config = config
+        self.random = random
+        self.stats = stats
+        self.n_written = n_written
+
+    def save(self, path: str):
+        """
+        Write the checkpoint to a file
+
+        The file is replaced atomically, so a job killed while saving leaves
+        the previous checkpoint intact.
+
+        Parameters
+        ----------
+        path    : str
+            checkpoint file
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Read a checkpoint file
+
+        Parameters
+        ----------
+        path    : str
+            checkpoint file written by `save`
+
+        Returns
+        -------
+        checkpoint : Checkpoint
+            the stored state
+        """
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+class SampleWriter:
+    """
+    Stream Monte Carlo samples to a preallocated memory-mapped .npy file
+
+    The file holds a structured array with fields "E" and "M", and with
+    store_configs=True a field "config" with the configuration of every
+    sample packed 8 sites per byte (np.unpackbits recovers the 0/1 sites).
+    The file can be read with np.load(path, mmap_mode="r").
+    """
+
+    def __init__(self, path: str, n_rows: int, N: int, store_configs: bool = False, resume: bool = False):
+        """
+        Create the output file, or open an existing one to continue writing
+
+        Parameters
+        ----------
+        path            : str
+            output .npy file
+        n_rows          : int
+            number of samples the file holds
+        N               : int
+            number of sites
+        store_configs   : bool
+            also store the configuration of every sample
+        resume          : bool
+            open an existing file instead of creating it
+        """
+        fields = [("E", float), ("M", np.int64)]
+        if store_configs:
+            fields.append(("config", np.uint8, (-(-N // 8),)))
+
+        self.path = path
+        self.store_configs = store_configs
+        if resume:
+            self.data = np.lib.format.open_memmap(path, mode="r+")
+            if self.data.dtype != np.dtype(fields) or len(self.data) != n_rows:
+                raise ValueError("output file does not match the run: " + str(path))
+        else:
+            self.data = np.lib.format.open_memmap(path, mode="w+", dtype=np.dtype(fields), shape=(n_rows,))
+
+    def write(self, row: int, E: float, M: int, spins=None):
+        """
+        Store one sample
+
+        Parameters
+        ----------
+        row     : int
+            index of the sample
+        E       : float
+            energy of the sample
+        M       : int
+            magnetization of the sample
+        spins   : np.ndarray, optional
+            spin configuration of the sample, stored with store_configs=True
+        """
+        self.data["E"][row] = E
+        self.data["M"][row] = M
+        if self.store_configs:
+            self.data["config"][row] = np.packbits(spins > 0)
+
+    def flush(self):
+        """
+        Write the pending samples to disk
+        """
+        self.data.flush()
@@ -0,0 +1,196 @@
+import numpy as np
+
+from .couplings import Couplings
+
+
+def union_find(n: int, edge_i, edge_j):
+    """
+    Label the connected components of a graph given as an edge list
+
+    Roots are hooked onto the smaller root of every edge and the parent
+    pointers are then fully compressed, until no edge joins two roots.
+
+    Parameters
+    ----------
+    n       : int
+        number of nodes
+    edge_i  : np.ndarray
+        first node of every edge
+    edge_j  : np.ndarray
+        second node of every edge
+
+    Returns
+    -------
+    labels : np.ndarray
+        smallest node index in the component of every node
+    """
+    parent = np.arange(n)
+    while True:
+        root_i, root_j = parent[edge_i], parent[edge_j]
+        hook = root_i != root_j
+        if not hook.any():
+            return parent
+        np.minimum.at(parent, np.maximum(root_i[hook], root_j[hook]), np.minimum(root_i[hook], root_j[hook]))
+
+        grand = parent[parent]
+        while not np.array_equal(grand, parent):
+            parent = grand
+            grand = parent[parent]
+
+
+def _bond_probability(weights, T: float):
+    """
+    Return the Fortuin-Kasteleyn bond probability 1 - exp(-2|J|/T) of satisfied couplings
+    """
+    return -np.expm1(-2 * np.abs(weights) / T)
+
+
+def swendsen_wang_sweep(couplings: Couplings, spins, T: float, random=np.random.random):
+    """
+    Swendsen-Wang update of every site
+
+    Every satisfied coupling (J s_i s_j < 0) becomes a bond with probability
+    1 - exp(-2|J|/T). The field mu is represented by a ghost spin fixed to +1
+    with coupling mu_i to every site. Clusters are labeled by union-find and
+    every cluster not containing the ghost is flipped with probability 1/2.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    spins       : np.ndarray
+        float spin configuration of +1/-1 values, updated in place
+    T           : float
+        temperature of the sweep
+    random      : callable
+        returns an array of uniform random numbers of a given size
+
+    Returns
+    -------
+    delta_e : float
+        energy change of the sweep
+    delta_m : int
+        magnetization change of the sweep
+    flipped : int
+        number of sites flipped
+    """
+    N = couplings.N
+    ei, ej, w = couplings.edge_i, couplings.edge_j, couplings.edge_w
+    mu = couplings.mu
+
+    bonds = (w * spins[ei] * spins[ej] < 0) & (random(len(w)) < _bond_probability(w, T))
+    ghost = (mu * spins < 0) & (random(N) < _bond_probability(mu, T))
+
+    labels = union_find(N + 1, np.concatenate([ei[bonds], np.flatnonzero(ghost)]),
+                        np.concatenate([ej[bonds], np.full(ghost.sum(), N)]))
+
+    flip = random(N + 1) < .5
+    flip[labels[N]] = False
+    flipped = flip[labels[:N]]
+
+    before = couplings.energy(spins)
+    delta_m = -2 * int(spins[flipped].sum())
+    spins[flipped] *= -1
+    return couplings.energy(spins) - before, delta_m, int(flipped.sum())
+
+
+def wolff_update(couplings: Couplings, spins, T: float, random=np.random.random):
+    """
+    Grow and flip a single Wolff cluster
+
+    The cluster grows from a random site over satisfied couplings with
+    probability 1 - exp(-2|J|/T). The flip is then accepted with probability
+    min(1, exp(-dE_mu/T)), where dE_mu is the change of the field energy.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    spins       : np.ndarray
+        float spin configuration of +1/-1 values, updated in place
+    T           : float
+        temperature of the update
+    random      : callable
+        returns an array of uniform random numbers of a given size
+
+    Returns
+    -------
+    delta_e : float
+        energy change of the update
+    delta_m : int
+        magnetization change of the update
+    flipped : int
+        number of sites in the cluster, 0 if the field rejected the flip
+    """
+    indptr, indices, weights = couplings.indptr, couplings.indices, couplings.weights
+    seed = min(int(random() * couplings.N), couplings.N - 1)
+
+    in_cluster = np.zeros(couplings.N, dtype=bool)
+    in_cluster[seed] = True
+    cluster = [seed]
+    stack = [seed]
+    while stack:
+        i = stack.pop()
+        nbrs, w = indices[indptr[i]:indptr[i + 1]], weights[indptr[i]:indptr[i + 1]]
+        grow = (~in_cluster[nbrs]) & (w * spins[i] * spins[nbrs] < 0)
+        grow[grow] = random(grow.sum()) < _bond_probability(w[grow], T)
+        new = nbrs[grow]
+        in_cluster[new] = True
+        cluster.extend(new.tolist())
+        stack.extend(new.tolist())
+
+    cluster = np.array(cluster)
+    delta_field = -2 * np.dot(couplings.mu[cluster], spins[cluster])
+    if delta_field > 0 and np.exp(-delta_field / T) <= random():
+        return 0.0, 0, 0
+
+    # Only couplings that leave the cluster change sign
+    lengths = indptr[cluster + 1] - indptr[cluster]
+    entries = np.repeat(indptr[cluster] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    rows = np.repeat(cluster, lengths)
+    leaving = ~in_cluster[indices[entries]]
+    delta_coupling = -2 * np.dot(weights[entries][leaving], spins[rows[leaving]] * spins[indices[entries][leaving]])
+
+    delta_m = -2 * int(spins[cluster].sum())
+    spins[cluster] *= -1
+    return delta_coupling + delta_field, delta_m, len(cluster)
+
+
+def wolff_sweep(couplings: Couplings, spins, T: float, random=np.random.random, n_clusters: int = 1):
+    """
+    Flip a fixed number of Wolff clusters
+
+    The number of clusters must not depend on the sizes of the clusters
+    flipped, otherwise the measurements taken after the sweep are biased.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    spins       : np.ndarray
+        float spin configuration of +1/-1 values, updated in place
+    T           : float
+        temperature of the sweep
+    random      : callable
+        returns an array of uniform random numbers of a given size
+    n_clusters  : int
+        number of clusters to grow
+
+    Returns
+    -------
+    delta_e : float
+        energy change of the sweep
+    delta_m : int
+        magnetization change of the sweep
+    flipped : int
+        number of sites flipped
+    """
+    delta_e = 0.0
+    delta_m = 0
+    flipped = 0
+    for k in range(n_clusters):
+        cluster_e, cluster_m, size = wolff_update(couplings, spins, T, random)
+        delta_e += cluster_e
+        delta_m += cluster_m
+        flipped += size
+    return delta_e, delta_m, flipped
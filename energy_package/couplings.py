@@ -0,0 +1,404 @@
+import numpy as np
+import networkx as nx
+
+from . import kernels
+
+
+def _discrete_unit(values, reach: float, max_levels: int):
+    """
+    Return (q, K) when all couplings and fields `values` are small integer
+    multiples of a unit q and the largest local field `reach` is K q with
+    K <= max_levels, None otherwise
+    """
+    values = np.abs(np.asarray(values, dtype=float))
+    values = values[values > 0]
+    unit = values.min() if len(values) else 1.0
+
+    for d in range(1, 13):
+        ratios = values * d / unit
+        if np.allclose(ratios, np.rint(ratios), rtol=0, atol=1e-9):
+            unit /= d
+            K = int(np.rint(reach / unit))
+            return (unit, K) if K <= max_levels else None
+    return None
+
+
+# Acceptance tables kept per couplings, enough for a tempering ladder while
+# the temperatures an adaptive ladder moves through are dropped again
+_MAX_TABLES = 64
+
+
+def _acceptance_table(unit, T: float):
+    """
+    Return (q, K, acceptance) with acceptance[k + K] = min(1, exp(2 q k / T)) for a unit (q, K)
+    """
+    q, K = unit
+    return (q, K, np.exp(np.minimum(2 * q * np.arange(-K, K + 1) / T, 0)))
+
+
+def _cached_acceptance_table(tables: dict, unit, T: float):
+    """
+    Return the acceptance table of T from a cache of the most recently used
+    temperatures, evicting the least recently used beyond _MAX_TABLES
+    """
+    table = tables.pop(T, None)
+    if table is None:
+        table = _acceptance_table(unit, T)
+        if len(tables) >= _MAX_TABLES:
+            del tables[next(iter(tables))]
+    tables[T] = table
+    return table
+
+
+class Couplings:
+    """
+    Compiled coupling structure of an Ising hamiltonian
+
+    Stores the symmetric coupling matrix in compressed sparse row (CSR) form
+    (`indptr`, `indices`, `weights`), the list of unique edges and the field
+    vector `mu`. All methods work on spin arrays, where a site that is on in
+    the BitString has spin +1 and a site that is off has spin -1.
+    """
+
+    def __init__(self, N: int, edge_i, edge_j, edge_w, mu=None):
+        """
+        Build the CSR arrays from a list of unique edges
+
+        Parameters
+        ----------
+        N       : int
+            number of sites
+        edge_i  : array_like
+            first site of every edge
+        edge_j  : array_like
+            second site of every edge
+        edge_w  : array_like
+            coupling strength of every edge
+        mu      : array_like, optional
+            field on every site, defaults to all zeros, always copied so
+            later in place edits of the caller's array do not leak in
+        """
+        self.N = int(N)
+        self.edge_i = np.asarray(edge_i, dtype=np.int64)
+        self.edge_j = np.asarray(edge_j, dtype=np.int64)
+        self.edge_w = np.asarray(edge_w, dtype=float)
+
+        if mu is None:
+            mu = np.zeros(self.N)
+        self.mu = np.array(mu, dtype=float)
+
+        rows = np.concatenate([self.edge_i, self.edge_j])
+        cols = np.concatenate([self.edge_j, self.edge_i])
+        vals = np.concatenate([self.edge_w, self.edge_w])
+        order = np.lexsort((cols, rows))
+
+        self.rows = rows[order]
+        self.indices = cols[order]
+        self.weights = vals[order]
+        self.indptr = np.zeros(self.N + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=self.N), out=self.indptr[1:])
+
+    @classmethod
+    def from_graph(cls, G: nx.Graph, mu=None):
+        """
+        Compile the couplings of a networkx graph
+
+        Sites are numbered in the order of `G.nodes`, edges without a
+        `weight` attribute get weight 1 and self loops are ignored.
+
+        Parameters
+        ----------
+        G   : nx.Graph
+            graph of ising interactions
+        mu  : array_like, optional
+            field on every site
+
+        Returns
+        -------
+        couplings : Couplings
+            compiled couplings of `G`
+        """
+        index = {node: k for k, node in enumerate(G)}
+        edges = [(index[u], index[v], w) for u, v, w in G.edges(data="weight", default=1.0) if u != v]
+
+        if edges:
+            edge_i, edge_j, edge_w = zip(*edges)
+        else:
+            edge_i, edge_j, edge_w = (), (), ()
+
+        return cls(len(index), edge_i, edge_j, edge_w, mu)
+
+    def neighbors(self, i: int):
+        """
+        Return neighbor indices and coupling weights of site i
+
+        Parameters
+        ----------
+        i    : int
+            site index
+
+        Returns
+        -------
+        indices : np.ndarray
+            indices of the neighbors of i
+        weights : np.ndarray
+            couplings between i and its neighbors
+        """
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:stop], self.weights[start:stop]
+
+    def local_field(self, spins):
+        """
+        Return the coupling field sum_j J_ij s_j acting on every site
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            spin configuration of +1/-1 values
+
+        Returns
+        -------
+        field : np.ndarray
+            coupling field on every site
+        """
+        return np.bincount(self.rows, weights=self.weights * spins[self.indices], minlength=self.N)
+
+    def energy(self, spins):
+        """
+        Return energy of a spin configuration
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            spin configuration of +1/-1 values
+
+        Returns
+        -------
+        energy : float
+            energy of the configuration
+        """
+        return np.dot(self.edge_w, spins[self.edge_i] * spins[self.edge_j]) + np.dot(self.mu, spins)
+
+    def energy_batch(self, spins):
+        """
+        Return energies of many spin configurations at once
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            2D array with one +1/-1 spin configuration per row
+
+        Returns
+        -------
+        energies : np.ndarray
+            energy of every configuration
+        """
+        spins = np.asarray(spins)
+        energies = spins @ self.mu
+
+        # Edge products are formed a bounded number of rows at a time
+        rows = max(1, 2 ** 22 // max(1, len(self.edge_w)))
+        for start in range(0, len(spins), rows):
+            block = spins[start:start + rows]
+            energies[start:start + rows] += (block[:, self.edge_i] * block[:, self.edge_j]) @ self.edge_w
+
+        return energies
+
+    def delta_e(self, spins, i: int):
+        """
+        Return energy change of flipping the spin at site i
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            spin configuration of +1/-1 values
+        i       : int
+            site to flip
+
+        Returns
+        -------
+        delta : float
+            energy after the flip minus energy before the flip
+        """
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        field = np.dot(self.weights[start:stop], spins[self.indices[start:stop]])
+        return -2 * spins[i] * (field + self.mu[i])
+
+    def delta_unit(self, max_levels: int = 4096):
+        """
+        Detect whether every flip energy is a multiple of a common unit
+
+        When all couplings and fields are small integer multiples of a unit q,
+        every delta_e is -2 q k for an integer k with |k| <= K, so Metropolis
+        acceptance can be looked up in a table instead of calling exp.
+
+        Parameters
+        ----------
+        max_levels  : int
+            largest K for which a table is worth building
+
+        Returns
+        -------
+        unit : tuple or None
+            (q, K), or None if the energies are not discrete enough
+        """
+        if not hasattr(self, "_delta_unit"):
+            reach = np.bincount(self.rows, weights=np.abs(self.weights), minlength=self.N) + np.abs(self.mu)
+            self._delta_unit = _discrete_unit(np.concatenate([self.weights, self.mu]),
+                                              reach.max() if self.N else 0.0, max_levels)
+        return self._delta_unit
+
+    def acceptance_table(self, T: float):
+        """
+        Return the Metropolis acceptance table at temperature T, if energies are discrete
+
+        Parameters
+        ----------
+        T   : float
+            temperature
+
+        Returns
+        -------
+        table : tuple or None
+            (q, K, acceptance) where acceptance[k + K] = min(1, exp(2 q k / T))
+            is the acceptance of delta_e = -2 q k, or None for continuous energies
+        """
+        unit = self.delta_unit()
+        if unit is None:
+            return None
+
+        if getattr(self, "_tables", None) is None:
+            self._tables = {}
+        return _cached_acceptance_table(self._tables, unit, T)
+
+    def metropolis_sweep(self, spins, T: float, random=np.random.random):
+        """
+        Metropolis sweep that visits the sites one at a time in order,
+        run by the compiled kernel when the numba backend is selected
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            float spin configuration of +1/-1 values, updated in place
+        T       : float
+            temperature of the sweep
+        random  : callable
+            returns an array of uniform random numbers of a given size
+
+        Returns
+        -------
+        delta_e : float
+            energy change of the sweep
+        delta_m : int
+            magnetization change of the sweep
+        flipped : int
+            number of sites flipped
+        """
+        draws = random(self.N)
+        table = self.acceptance_table(T)
+        if kernels.get_backend() == "numba":
+            return kernels.metropolis_sweep(self, spins, T, draws, table)
+
+        delta_e = 0.0
+        delta_m = 0
+        flipped = 0
+        for i in range(self.N):
+            delta = self.delta_e(spins, i)
+
+            if table is None:
+                accept = delta <= 0 or np.exp(-delta / T) > draws[i]
+            else:
+                accept = table[2][int(round(-delta / (2 * table[0]))) + table[1]] > draws[i]
+
+            if accept:
+                delta_e += delta
+                delta_m -= 2 * int(spins[i])
+                flipped += 1
+                spins[i] = -spins[i]
+        return delta_e, delta_m, flipped
+
+    def coloring(self):
+        """
+        Return a greedy coloring of the sites, largest degree first
+
+        Returns
+        -------
+        colors : np.ndarray
+            color of every site, no two coupled sites share a color
+        """
+        colors = np.full(self.N, -1, dtype=np.int64)
+        for i in np.argsort(-np.diff(self.indptr), kind="stable"):
+            used = set(colors[self.indices[self.indptr[i]:self.indptr[i + 1]]].tolist())
+            color = 0
+            while color in used:
+                color += 1
+            colors[i] = color
+        return colors
+
+    def color_classes(self):
+        """
+        Return the sites of every color class with their coupling rows,
+        built once from `coloring`
+
+        Returns
+        -------
+        classes : list[tuple]
+            (sites, rows, indices, weights) for every color, where rows
+            numbers the entries of `sites` and indices/weights are the
+            couplings of the class in CSR order
+        """
+        if getattr(self, "_color_classes", None) is None:
+            colors = self.coloring()
+            self._color_classes = []
+            for color in range(colors.max() + 1 if self.N else 0):
+                sites = np.flatnonzero(colors == color)
+                position = np.full(self.N, -1, dtype=np.int64)
+                position[sites] = np.arange(len(sites))
+                mask = colors[self.rows] == color
+                self._color_classes.append((sites, position[self.rows[mask]], self.indices[mask], self.weights[mask]))
+        return self._color_classes
+
+    def checkerboard_sweep(self, spins, T: float, random=np.random.random):
+        """
+        Metropolis sweep that updates one color class at a time
+
+        Sites of a color class are not coupled to each other, so their flips
+        are independent and can be proposed and accepted as whole arrays.
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            float spin configuration of +1/-1 values, updated in place
+        T       : float
+            temperature of the sweep
+        random  : callable
+            returns an array of uniform random numbers of a given size
+
+        Returns
+        -------
+        delta_e : float
+            energy change of the sweep
+        delta_m : int
+            magnetization change of the sweep
+        flipped : int
+            number of sites flipped
+        """
+        delta_e = 0.0
+        delta_m = 0
+        n_flipped = 0
+        table = self.acceptance_table(T)
+        for sites, rows, indices, weights in self.color_classes():
+            field = np.bincount(rows, weights=weights * spins[indices], minlength=len(sites))
+            delta = -2 * spins[sites] * (field + self.mu[sites])
+            if table is None:
+                accept = random(len(sites)) < np.exp(-np.maximum(delta, 0) / T)
+            else:
+                q, K, acceptance = table
+                accept = random(len(sites)) < acceptance[np.rint(-delta / (2 * q)).astype(np.int64) + K]
+
+            flipped = sites[accept]
+            delta_e += delta[accept].sum()
+            delta_m -= 2 * int(spins[flipped].sum())
+            n_flipped += len(flipped)
+            spins[flipped] *= -1
+        return delta_e, delta_m, n_flipped
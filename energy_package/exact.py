@@ -0,0 +1,461 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import kernels
+from .couplings import Couplings
+
+
+def gray_code(k):
+    """
+    Return the k-th Gray code, k ^ (k >> 1)
+
+    Parameters
+    ----------
+    k   : int or np.ndarray
+        index into the Gray code sequence
+
+    Returns
+    -------
+    code : int or np.ndarray
+        Gray code of k
+    """
+    return k ^ (k >> 1)
+
+
+class GrayEnumerator:
+    """
+    Enumerate energies and magnetizations of all 2^N states in Gray-code order
+
+    The sites are split into `block_bits` low sites and N - `block_bits` high
+    sites. All 2^block_bits low configurations are tabulated once, in Gray
+    order, together with their energy and magnetization. The high sites are
+    walked in Gray order one flip at a time, so moving to the next block only
+    costs O(degree) updates of the high energy and of the coupling field the
+    high sites exert on the low ones. Every block is then a handful of
+    vectorized NumPy operations over 2^block_bits states.
+    """
+
+    def __init__(self, couplings: Couplings, block_bits: int = 16):
+        """
+        Tabulate the low block and split the couplings into low, cross and high parts
+
+        Parameters
+        ----------
+        couplings   : Couplings
+            compiled couplings of the hamiltonian
+        block_bits  : int
+            number of low sites enumerated in each vectorized block
+        """
+        self.couplings = couplings
+        self.N = couplings.N
+        self.k = min(block_bits, self.N)
+        self.n_blocks = 2 ** (self.N - self.k)
+
+        k = self.k
+        mu = couplings.mu
+        ei, ej, w = couplings.edge_i, couplings.edge_j, couplings.edge_w
+
+        t = np.arange(2 ** k, dtype=np.int64)
+        self.low_spins = (((gray_code(t)[:, None] >> np.arange(k)) & 1) * 2 - 1).astype(np.int8)
+
+        self.low_energy = self.low_spins @ mu[:k]
+        low = (ei < k) & (ej < k)
+        for i, j, wij in zip(ei[low], ej[low], w[low]):
+            self.low_energy += wij * (self.low_spins[:, i] * self.low_spins[:, j])
+        self.low_magnetization = self.low_spins.sum(axis=1, dtype=np.int64)
+
+        # Every cross edge is stored as (low site, high site)
+        cross = (ei < k) != (ej < k)
+        cross_low = np.where(ei[cross] < k, ei[cross], ej[cross])
+        cross_high = np.where(ei[cross] < k, ej[cross], ei[cross])
+        self.boundary, cross_pos = np.unique(cross_low, return_inverse=True)
+        self.boundary_spins = self.low_spins[:, self.boundary].astype(float)
+
+        high = (ei >= k) & (ej >= k)
+        self.high_edges = (ei[high], ej[high], w[high])
+
+        self.high_neighbors = []
+        self.cross_neighbors = []
+        for q in range(k, self.N):
+            indices, weights = couplings.neighbors(q)
+            mask = indices >= k
+            self.high_neighbors.append((indices[mask], weights[mask]))
+            mask = cross_high == q
+            self.cross_neighbors.append((cross_pos[mask], w[cross][mask]))
+
+        self.cross_edges = (cross_pos, cross_high, w[cross])
+
+    def _high_state(self, r: int):
+        """
+        Return spins, energy and boundary field of the high sites for block r
+        """
+        spins = np.zeros(self.N)
+        bits = gray_code(r)
+        for q in range(self.k, self.N):
+            spins[q] = 2 * ((bits >> (q - self.k)) & 1) - 1
+
+        hi, hj, hw = self.high_edges
+        energy = np.dot(hw, spins[hi] * spins[hj]) + np.dot(self.couplings.mu[self.k:], spins[self.k:])
+
+        pos, q, cw = self.cross_edges
+        field = np.bincount(pos, weights=cw * spins[q], minlength=len(self.boundary)).astype(float)
+        return spins, energy, field
+
+    def blocks(self, start: int = 0, stop: int = None):
+        """
+        Yield energies and magnetizations of the blocks start to stop
+
+        Parameters
+        ----------
+        start   : int
+            index of the first block
+        stop    : int, optional
+            index one past the last block, defaults to all blocks
+
+        Yields
+        ------
+        E  : np.ndarray
+            energies of the 2^block_bits states of the block
+        M  : np.ndarray
+            magnetizations of the 2^block_bits states of the block
+        """
+        if stop is None:
+            stop = self.n_blocks
+        if start >= stop:
+            return
+
+        spins, high_energy, field = self._high_state(start)
+        high_magnetization = int(spins[self.k:].sum())
+        mu = self.couplings.mu
+
+        for r in range(start, stop):
+            yield (self.low_energy + self.boundary_spins @ field + high_energy,
+                   self.low_magnetization + high_magnetization)
+
+            if r + 1 == stop:
+                break
+
+            # Gray code r -> r+1 flips the bit at the lowest set bit of r+1
+            q = self.k + ((r + 1) & -(r + 1)).bit_length() - 1
+            indices, weights = self.high_neighbors[q - self.k]
+            s = spins[q]
+            high_energy += -2 * s * (np.dot(weights, spins[indices]) + mu[q])
+            high_magnetization -= 2 * int(s)
+            pos, weights = self.cross_neighbors[q - self.k]
+            field[pos] -= 2 * s * weights
+            spins[q] = -s
+
+
+def block_moments(energies, mags, beta: float, counts=None):
+    """
+    Return the log-domain partial sums of a set of states
+
+    Parameters
+    ----------
+    energies    : np.ndarray
+        energies of the states
+    mags        : np.ndarray
+        magnetizations of the states
+    beta        : float
+        inverse temperature
+    counts      : np.ndarray, optional
+        number of times every state is counted, once by default
+
+    Returns
+    -------
+    moments : tuple
+        log Z of the states, followed by the Boltzmann averages of
+        E, E^2, M and M^2 over these states only
+    """
+    shift = energies.min()
+    weights = np.exp(-beta * (energies - shift))
+    if counts is not None:
+        weights *= counts
+    Z = weights.sum()
+    return (np.log(Z) - beta * shift,
+            np.dot(weights, energies) / Z,
+            np.dot(weights, energies ** 2) / Z,
+            np.dot(weights, mags) / Z,
+            np.dot(weights, mags ** 2.0) / Z)
+
+
+def merge_moments(partials):
+    """
+    Merge log-domain partial sums of disjoint sets of states
+
+    Parameters
+    ----------
+    partials    : list
+        tuples returned by `block_moments` or `merge_moments`
+
+    Returns
+    -------
+    moments : tuple
+        log Z and Boltzmann averages of E, E^2, M and M^2 over the union
+    """
+    partials = np.array(partials, dtype=float).reshape(-1, 5)
+    logZ = partials[:, 0]
+    shift = logZ.max()
+    weights = np.exp(logZ - shift)
+    total = weights.sum()
+    return (shift + np.log(total),) + tuple(weights @ partials[:, 1:] / total)
+
+
+_worker = None
+
+
+def _make_enumerator(couplings: Couplings, block_bits: int, backend: str):
+    """
+    Return the vectorized enumerator, or the couplings and block size for the numba kernel
+    """
+    if backend == "numba":
+        return (couplings, min(block_bits, couplings.N))
+    return GrayEnumerator(couplings, block_bits)
+
+
+def _init_worker(couplings: Couplings, block_bits: int, backend: str):
+    """
+    Select the kernel backend and build the enumerator once per worker process
+    """
+    global _worker
+    kernels.set_backend(backend)
+    kernels.warm_up()
+    _worker = _make_enumerator(couplings, block_bits, backend)
+
+
+def _enumerate_blocks(enumerator, start: int, stop: int, beta: float):
+    """
+    Return the merged partial sums of the blocks start to stop at inverse temperature beta
+    """
+    if isinstance(enumerator, GrayEnumerator):
+        return merge_moments([block_moments(E, M, beta) for E, M in enumerator.blocks(start, stop)])
+
+    # Blocks of 2^k states are contiguous runs of the full Gray-code sequence
+    couplings, k = enumerator
+    return kernels.gray_moments(couplings, start << k, stop << k, beta)
+
+
+def _enumerate_range(task):
+    """
+    Return the merged partial sums of a range of blocks with the enumerator of the worker process
+    """
+    start, stop, beta = task
+    return _enumerate_blocks(_worker, start, stop, beta)
+
+
+def exact_averages(couplings: Couplings, T: float, block_bits: int = 16, n_workers: int = None,
+                   chunk_size: int = None):
+    """
+    Compute average energy, magnetization, heat capacity, and
+    magnetic susceptibility by exact Gray-code enumeration
+
+    With `n_workers` the 2^N states are split into contiguous ranges of
+    Gray-code blocks that are enumerated on a process pool. Every range
+    returns log-domain partial sums, which are merged exactly. With the
+    numba kernel backend every range is walked one flip at a time by a
+    compiled kernel instead of in vectorized blocks.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    T           : float
+        temperature to compute at
+    block_bits  : int
+        number of sites enumerated in each vectorized block
+    n_workers   : int, optional
+        number of worker processes, enumerates serially by default
+    chunk_size  : int, optional
+        number of states handed to a worker at a time, rounded to whole
+        blocks, defaults to four ranges per worker
+
+    Returns
+    -------
+    E  : float
+        Average energy of the hamiltonian
+    M  : float
+        Average magnetization of the hamiltonian
+    HC  : float
+        Average heat capacity of the hamiltonian
+    MS  : float
+        Average magnetic susceptibility of the hamiltonian
+    """
+    beta = 1 / T
+    n_blocks = 2 ** (couplings.N - min(block_bits, couplings.N))
+    backend = kernels.get_backend()
+
+    if n_workers is None or n_workers <= 1 or n_blocks == 1:
+        partials = [_enumerate_blocks(_make_enumerator(couplings, block_bits, backend), 0, n_blocks, beta)]
+    else:
+        if chunk_size is None:
+            step = -(-n_blocks // (4 * n_workers))
+        else:
+            step = max(1, chunk_size >> min(block_bits, couplings.N))
+        tasks = [(start, min(start + step, n_blocks), beta) for start in range(0, n_blocks, step)]
+
+        with ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                 initargs=(couplings, block_bits, backend)) as pool:
+            partials = list(pool.map(_enumerate_range, tasks))
+
+    logZ, E, EE, M, MM = merge_moments(partials)
+
+    HC = (EE - E ** 2) * (T ** -2)
+    MS = (MM - M ** 2) * (T ** -1)
+
+    return E, M, HC, MS
+
+
+def _compress_histogram(energies, mags, counts, N: int):
+    """
+    Merge repeated (energy, magnetization) pairs of a histogram, summing their counts
+    """
+    levels, level_index = np.unique(energies, return_inverse=True)
+    key = level_index * (2 * N + 1) + (mags + N)
+    keys, key_index = np.unique(key, return_inverse=True)
+    counts = np.bincount(key_index, weights=counts)
+    return levels[keys // (2 * N + 1)], keys % (2 * N + 1) - N, counts
+
+
+class DensityOfStates:
+    """
+    Joint density of states g(E, M) of an Ising hamiltonian
+
+    Stores how many of the 2^N states have energy E and magnetization M, so
+    thermal averages at any temperature T, and with any additional uniform
+    field h (which adds h*M to the energy), are a reweighting of the histogram
+    instead of a new enumeration.
+    """
+
+    def __init__(self, energies, magnetizations, counts):
+        """
+        Store the histogram
+
+        Parameters
+        ----------
+        energies        : np.ndarray
+            energy of every histogram entry
+        magnetizations  : np.ndarray
+            magnetization of every histogram entry
+        counts          : np.ndarray
+            number of states with that energy and magnetization
+        """
+        self.energies = np.asarray(energies, dtype=float)
+        self.magnetizations = np.asarray(magnetizations, dtype=float)
+        self.counts = np.asarray(counts, dtype=float)
+        self.log_counts = np.log(self.counts)
+
+    @classmethod
+    def from_couplings(cls, couplings: Couplings, block_bits: int = 16, decimals: int = 10):
+        """
+        Build the histogram by a single Gray-code enumeration
+
+        Parameters
+        ----------
+        couplings   : Couplings
+            compiled couplings of the hamiltonian
+        block_bits  : int
+            number of sites enumerated in each vectorized block
+        decimals    : int
+            energies are rounded to this many decimals, so that degenerate
+            levels differing only by floating point noise share an entry
+
+        Returns
+        -------
+        dos : DensityOfStates
+            joint density of states of the hamiltonian
+        """
+        N = couplings.N
+        pending = []
+        size = 0
+
+        for block_energies, block_mags in GrayEnumerator(couplings, block_bits).blocks():
+            entry = _compress_histogram(np.round(block_energies, decimals), block_mags,
+                                        np.ones(len(block_energies)), N)
+            pending.append(entry)
+            size += len(entry[0])
+
+            if size > 2 ** 18:
+                pending = [_compress_histogram(*map(np.concatenate, zip(*pending)), N)]
+                size = len(pending[0][0])
+
+        energies, mags, counts = _compress_histogram(*map(np.concatenate, zip(*pending)), N)
+        return cls(energies, mags, counts)
+
+    def _log_weights(self, T, h):
+        """
+        Yield slices of the flattened (T, h) grid with the total energy and
+        log Boltzmann weight of every entry, a bounded number of rows at a time
+        """
+        rows = max(1, 2 ** 22 // max(1, len(self.energies)))
+        for start in range(0, len(T), rows):
+            t, b = T[start:start + rows, None], h[start:start + rows, None]
+            energies = self.energies + b * self.magnetizations
+            yield slice(start, start + rows), energies, self.log_counts - energies / t
+
+    def log_partition(self, T, h=0.0):
+        """
+        Return the log partition function log Z
+
+        Parameters
+        ----------
+        T   : float or np.ndarray
+            temperatures to compute at
+        h   : float or np.ndarray
+            additional uniform field, broadcast against T
+
+        Returns
+        -------
+        logZ : float or np.ndarray
+            log partition function at every (T, h)
+        """
+        T, h = np.broadcast_arrays(np.asarray(T, dtype=float), np.asarray(h, dtype=float))
+        logZ = np.zeros(T.size)
+
+        for rows, energies, log_weights in self._log_weights(T.ravel(), h.ravel()):
+            shift = log_weights.max(axis=1)
+            logZ[rows] = shift + np.log(np.exp(log_weights - shift[:, None]).sum(axis=1))
+
+        return logZ.reshape(T.shape)[()]
+
+    def averages(self, T, h=0.0):
+        """
+        Compute average energy, magnetization, heat capacity, and
+        magnetic susceptibility for arrays of temperatures and fields
+
+        Parameters
+        ----------
+        T   : float or np.ndarray
+            temperatures to compute at
+        h   : float or np.ndarray
+            additional uniform field, broadcast against T
+
+        Returns
+        -------
+        E  : float or np.ndarray
+            Average energy, including the h*M term
+        M  : float or np.ndarray
+            Average magnetization
+        HC  : float or np.ndarray
+            Heat capacity
+        MS  : float or np.ndarray
+            Magnetic susceptibility
+        """
+        T, h = np.broadcast_arrays(np.asarray(T, dtype=float), np.asarray(h, dtype=float))
+        E, M, EE, MM = (np.zeros(T.size) for i in range(4))
+
+        for rows, energies, log_weights in self._log_weights(T.ravel(), h.ravel()):
+            # log-sum-exp: weights are normalized against the largest one at every (T, h)
+            weights = np.exp(log_weights - log_weights.max(axis=1, keepdims=True))
+            weights /= weights.sum(axis=1, keepdims=True)
+
+            E[rows] = (weights * energies).sum(axis=1)
+            M[rows] = weights @ self.magnetizations
+            EE[rows] = (weights * (energies - E[rows, None]) ** 2).sum(axis=1)
+            MM[rows] = (weights * (self.magnetizations - M[rows, None]) ** 2).sum(axis=1)
+
+        T = T.ravel()
+        HC = EE * T ** -2
+        MS = MM * T ** -1
+
+        return tuple(x.reshape(h.shape)[()] for x in (E, M, HC, MS))
@@ -1,13 +1,53 @@
 import numpy as np
 import math      
+import os
+import time
 import copy as cp 
 import networkx as nx
-import random as rand
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from . import kernels
+from .couplings import Couplings
+from .exact import exact_averages, DensityOfStates
+from .transfer_matrix import bfs_layers, transfer_matrix_averages, transfer_matrix_cost
+from .elimination import elimination_order, elimination_averages
+from .symmetry import symmetric_averages, symmetric_cost
+from .analysis import ChainResults, TemperingResults, SampleAnalysis
+from .clusters import swendsen_wang_sweep, wolff_sweep
+from .accumulators import SampleAccumulator
+from .random_blocks import RandomBlocks
+from .lattice import hypercubic_edges
+from .observers import RunStatus
+from .checkpoint import Checkpoint, SampleWriter
+
+# Run time of the exact methods in states of Gray enumeration, for the auto
+# dispatch: the Python overhead of a transfer matrix layer and of an
+# eliminated site, and the work per entry of an elimination table
+_LAYER_COST = 4000
+_SITE_COST = 10000
+_ENTRY_COST = 8
+
+def _popcount(words):
+    """
+    Return the total number of set bits in an array of uint64 words
+    """
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.astype("<u8").view(np.uint8)).sum())
+
 
 class BitString:
     """
     Simple class to implement a config of bits
+
+    Bits are packed into uint64 words, with site i stored at bit N-1-i of the
+    integer value, so site 0 is the most significant bit. `config` unpacks
+    the words into a read-only array of ints on first access and is kept in
+    sync by `flip_site`.
     """
+
+    __slots__ = ("N", "_words", "_config", "_view")
     
     def __init__(self, N):
         """
@@ -19,7 +59,17 @@ class BitString:
             initial bitstring length
         """
         self.N = N
-        self.config = np.zeros(N, dtype=int) 
+        self._words = np.zeros(-(-N // 64), dtype=np.uint64)
+        self._config = None
+        self._view = None
+
+    def __getstate__(self):
+        return self.N, self._words
+
+    def __setstate__(self, state):
+        self.N, self._words = state
+        self._config = None
+        self._view = None
 
     def __repr__(self):
         string = ""
@@ -41,7 +91,7 @@ class BitString:
         eq : boolean
             true if bitstrings are identical
         """  
-        return all(self.config == other.config)
+        return self.N == other.N and bool(np.all(self._words == other._words))
     
     def __len__(self):
         """
@@ -52,7 +102,28 @@ class BitString:
         len : int
             length of bitstring
         """
-        return len(self.config)
+        return self.N
+
+    @property
+    def config(self):
+        """
+        Read-only array of the bits, site 0 first
+        
+        Returns
+        -------
+        config : np.ndarray
+            array of 0/1 ints
+        """
+        if self._config is None:
+            bits = np.unpackbits(self._words.astype("<u8").view(np.uint8), bitorder="little")
+            self._config = bits[:self.N][::-1].astype(int)
+            self._view = self._config.view()
+            self._view.flags.writeable = False
+        return self._view
+
+    @config.setter
+    def config(self, s):
+        self.set_config(s)
 
     def on(self):
         """
@@ -63,12 +134,7 @@ class BitString:
         sum : int
             number of on bits
         """
-        sum = 0
-        for i in self.config:
-            if i == 1:
-                sum += 1
-        
-        return sum
+        return _popcount(self._words)
         
 
     def off(self):
@@ -80,12 +146,7 @@ class BitString:
         sum : int
             number of off bits
         """
-        sum = 0
-        for i in self.config:
-            if i == 0:
-                sum += 1
-        
-        return sum
+        return self.N - _popcount(self._words)
 
     def flip_site(self,i):
         """
@@ -94,9 +155,16 @@ class BitString:
         Parameters
         ----------
         i    : int
-            index of site to flip
+            index of site to flip, negative indices count from the end
         """
-        self.config[i] = -1*(self.config[i] - 1)
+        if not -self.N <= i < self.N:
+            raise IndexError("site index out of range: " + str(i))
+        if i < 0:
+            i += self.N
+        p = self.N - 1 - i
+        self._words[p >> 6] ^= np.uint64(1 << (p & 63))
+        if self._config is not None:
+            self._config[i] ^= 1
         return self
     
     def integer(self):
@@ -108,11 +176,9 @@ class BitString:
         sum : int
             integer corresponding to bitstring
         """
-        exp = 0
         sum = 0
-        for i in range(self.config.size-1, 0, -1):
-            sum += self.config[i] * 2**exp
-            exp += 1
+        for k, word in enumerate(self._words):
+            sum |= int(word) << (64 * k)
         
         return sum
  
@@ -125,7 +191,13 @@ class BitString:
         s    : list[int]
             input list of ints
         """
-        self.config = np.array(s)
+        bits = np.asarray(s) != 0
+        self.N = len(bits)
+        n_words = -(-self.N // 64)
+        padded = np.zeros(64 * n_words, dtype=np.uint8)
+        padded[:self.N] = bits[::-1]
+        self._words = np.packbits(padded, bitorder="little").view("<u8").astype(np.uint64)
+        self._config = None
         return self
 
     def set_integer_config(self, dec:int):
@@ -137,26 +209,110 @@ class BitString:
         dec    : int
             input integer
         """
-             
-        temp = dec
-        rem = 0
-        arr = []
+        dec = int(dec) & ((1 << self.N) - 1)
+        for k in range(len(self._words)):
+            self._words[k] = (dec >> (64 * k)) & 0xFFFFFFFFFFFFFFFF
+        self._config = None
         
-        self.config = np.zeros(len(self.config), dtype=int)
+        return self
+            
+            
+class StateBatch:
+    """
+    Class to hold many configurations of bits at once, one row per configuration
+    """
+    
+    def __init__(self, configs):
+        """
+        Set the configurations from a 2D array of 0/1 values
         
-        while temp != 0:
-            rem = temp % 2
-            temp = temp // 2
-            arr.append(rem)
+        Parameters
+        ----------
+        configs    : array_like
+            2D array with one configuration per row
+        """
+        self.configs = np.atleast_2d(np.asarray(configs, dtype=np.int8))
+        self.N = self.configs.shape[1]
+
+    @classmethod
+    def from_bitstrings(cls, bitstrings):
+        """
+        Stack a list of bitstrings into a batch
         
-        arr.reverse()
+        Parameters
+        ----------
+        bitstrings    : list[BitString]
+            configurations of equal length
         
-        for i in range(len(arr)):
-            self.config[len(self.config)-len(arr)+i] = arr[i]
+        Returns
+        -------
+        batch : StateBatch
+            batch holding the configurations
+        """
+        return cls(np.array([bs.config for bs in bitstrings]))
+
+    @classmethod
+    def from_integers(cls, integers, N:int):
+        """
+        Build a batch from the decimal integers of the configurations
         
-        return self
-            
-            
+        Parameters
+        ----------
+        integers    : array_like
+            integer of every configuration, as returned by BitString.integer()
+        N           : int
+            number of bits in each configuration
+        
+        Returns
+        -------
+        batch : StateBatch
+            batch holding the configurations
+        """
+        if N <= 63:
+            integers = np.asarray(integers, dtype=np.int64)
+            return cls((integers[:, None] >> np.arange(N - 1, -1, -1)) & 1)
+        return cls([[(int(k) >> (N - 1 - i)) & 1 for i in range(N)] for k in integers])
+
+    @property
+    def spins(self):
+        """
+        Configurations as +1 (on) / -1 (off) spins
+        
+        Returns
+        -------
+        spins : np.ndarray
+            2D array of spins, one row per configuration
+        """
+        return 2 * self.configs - 1
+
+    def __len__(self):
+        """
+        Return number of configurations in the batch
+        
+        Returns
+        -------
+        len : int
+            number of configurations
+        """
+        return len(self.configs)
+
+    def __getitem__(self, i:int):
+        """
+        Return configuration i as a BitString
+        
+        Parameters
+        ----------
+        i    : int
+            row of the configuration
+        
+        Returns
+        -------
+        bs : BitString
+            configuration i
+        """
+        return BitString(self.N).set_config(self.configs[i])
+
+
 class IsingHamiltonian:
     """
     Class to implement ising hamiltonian functions, compute energy, various average values
@@ -171,10 +327,211 @@ class IsingHamiltonian:
         G   : nx.Graph
             hamiltonian graph
         """
+        self._couplings = None
+        self._dos = None
+        self._edges = None
+        self._size = None
         self.G = G
         self.mu = np.array([0 for i in range(len(G))])
-        self.N = len(self.mu)
+
+    @classmethod
+    def from_edges(cls, N: int, edge_i, edge_j, edge_w=1.0, mu=None):
+        """
+        Build a hamiltonian from arrays of unique edges, without a networkx graph
+
+        The couplings are compiled directly from the arrays, G is only built
+        if it is accessed. Self loops are ignored, as in Couplings.from_graph.
+
+        Parameters
+        ----------
+        N       : int
+            number of sites
+        edge_i  : array_like
+            first site of every edge
+        edge_j  : array_like
+            second site of every edge
+        edge_w  : float or array_like
+            coupling strength of every edge, or one strength for all
+        mu      : float or array_like, optional
+            field on every site, or one field for all, all zeros by default
+
+        Returns
+        -------
+        ham : IsingHamiltonian
+            hamiltonian of the edges
+        """
+        return cls.__new__(cls)._set_edges(N, edge_i, edge_j, edge_w, mu)
+
+    def _set_edges(self, N: int, edge_i, edge_j, edge_w=1.0, mu=None):
+        """
+        Initialize from arrays of unique edges, see from_edges
+        """
+        edge_i = np.asarray(edge_i, dtype=np.int64).ravel()
+        edge_j = np.asarray(edge_j, dtype=np.int64).ravel()
+        edge_w = np.broadcast_to(np.asarray(edge_w, dtype=float), edge_i.shape)
+        keep = edge_i != edge_j
+
+        self._couplings = None
+        self._dos = None
+        self._G = None
+        self._size = None
+        self._edges = (edge_i[keep], edge_j[keep], edge_w[keep])
+        self.N = int(N)
+        self.mu = np.zeros(self.N) if mu is None else np.broadcast_to(np.asarray(mu, dtype=float), (self.N,)).copy()
+        return self
+
+    @classmethod
+    def from_sparse(cls, J, mu=None):
+        """
+        Build a hamiltonian from a sparse symmetric coupling matrix
+
+        Only the entries above the diagonal are read, so J may also be given
+        as its upper triangle alone.
+
+        Parameters
+        ----------
+        J   : scipy.sparse matrix or array
+            N x N coupling matrix, J[i, j] is the coupling of the edge i-j
+        mu  : array_like, optional
+            field on every site, all zeros by default
+
+        Returns
+        -------
+        ham : IsingHamiltonian
+            hamiltonian of the couplings
+        """
+        if hasattr(J, "tocoo"):
+            J = J.tocoo()
+            row, col, data = J.row, J.col, J.data
+        else:
+            J = np.asarray(J, dtype=float)
+            row, col = np.nonzero(J)
+            data = J[row, col]
+        upper = row < col
+        return cls.from_edges(J.shape[0], row[upper], col[upper], data[upper], mu)
+
+    @classmethod
+    def from_lattice(cls, shape, J=1.0, mu=None, periodic: bool = True):
+        """
+        Build the hamiltonian of a hypercubic lattice with uniform couplings
+
+        Parameters
+        ----------
+        shape       : int or tuple[int]
+            side lengths of the 1D, 2D or 3D lattice, sites numbered in C order
+        J           : float
+            coupling strength of every nearest-neighbor edge
+        mu          : array_like, optional
+            field on every site, all zeros by default
+        periodic    : bool
+            wrap every side around
+
+        Returns
+        -------
+        ham : IsingHamiltonian
+            hamiltonian of the lattice
+        """
+        edge_i, edge_j = hypercubic_edges(shape, periodic)
+        return cls.from_edges(int(np.prod(shape)), edge_i, edge_j, J, mu)
+
+    @property
+    def G(self):
+        """
+        Graph of ising interactions, assigning a new graph invalidates the couplings.
+        For a hamiltonian built from edge arrays the graph is built on first access.
+        """
+        if self._G is None:
+            G = nx.Graph()
+            G.add_nodes_from(range(self.N))
+            G.add_weighted_edges_from(zip(*(x.tolist() for x in self._edges)))
+            self._G = G
+            self._edges = None
+        return self._G
+
+    @G.setter
+    def G(self, G: nx.Graph):
+        self._G = G
+        self._edges = None
+        self.N = len(G)
+        self.invalidate()
+
+    @property
+    def mu(self):
+        """
+        Read-only array of site fields, assigning a new array invalidates the
+        couplings. In place edits raise ValueError, assign or set_mu instead.
+        """
+        return self._mu
+
+    @mu.setter
+    def mu(self, mus: np.array):
+        self._mu = np.array(mus, dtype=float)
+        self._mu.flags.writeable = False
+        self.invalidate()
+
+    @property
+    def couplings(self):
+        """
+        Compiled CSR couplings of G and mu, built on first use and rebuilt
+        when nodes or edges are added to or removed from G in place. Edits of
+        the weights of G in place need invalidate().
+
+        Returns
+        -------
+        couplings  : Couplings
+            compiled coupling structure
+        """
+        if self._couplings is not None and self._G is not None and self._size != self._graph_size():
+            self.invalidate()
+        if self._couplings is None:
+            if self._edges is not None:
+                self._couplings = Couplings(self.N, *self._edges, self.mu)
+            else:
+                self._couplings = Couplings.from_graph(self.G, self.mu)
+            self._size = self._graph_size()
+        return self._couplings
+
+    def _graph_size(self):
+        """
+        Return the number of nodes and edges of G, or None before G is built
+        """
+        return None if self._G is None else (self._G.number_of_nodes(), self._G.number_of_edges())
+
+    def sweep_function(self, mode:str):
+        """
+        Return the Monte Carlo sweep of a mode, called as sweep(spins, T, random)
     
+        Parameters
+        ----------
+        mode   : str
+            "sequential", "checkerboard", "wolff" or "swendsen-wang"
+            
+        Returns
+        -------
+        sweep  : callable
+            sweep updating a float spin array in place and returning the
+            energy change, magnetization change and number of flipped sites
+        """
+        couplings = self.couplings
+        if mode == "sequential":
+            return couplings.metropolis_sweep
+        if mode == "checkerboard":
+            return couplings.checkerboard_sweep
+        if mode == "wolff":
+            return partial(wolff_sweep, couplings)
+        if mode == "swendsen-wang":
+            return partial(swendsen_wang_sweep, couplings)
+        raise ValueError("unknown Monte Carlo mode: " + str(mode))
+
+    def invalidate(self):
+        """
+        Drop the compiled couplings so they are rebuilt on next use.
+        Must be called after editing the nodes, edges or weights of G in place.
+        """
+        self._couplings = None
+        self._dos = None
+        return self
+
     def energy(self, bs: BitString):
         """
         Compute energy of configuration, `bs`
@@ -189,18 +546,25 @@ class IsingHamiltonian:
         sum  : float
             Energy of the input configuration
         """
-        sum = 0
-        a_array = nx.to_numpy_array(self.G)
-            
-        for i in range(len(a_array)):
-            for j in range(i+1, len(a_array[i])):
-                sum += a_array[i][j] * (bs.config[i]*-2 + 1) * (bs.config[j]*-2 + 1)
-        
-        for i in range(len(self.mu)):
-            sum += self.mu[i]*-(bs.config[i]*-2+1)
-        
-        return sum
+        return self.couplings.energy(2 * bs.config - 1)
       
+    def spin_energy(self, spins):
+        """
+        Return energy of a spin configuration, used by the Monte Carlo runs
+        to start and refresh their tracked energy
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            flat spin configuration of +1/-1 values
+
+        Returns
+        -------
+        energy : float
+            energy of the configuration
+        """
+        return self.couplings.energy(spins)
+
     def magnetization(self, bs: BitString):
         """
         Return magnetization of bitstring
@@ -215,7 +579,43 @@ class IsingHamiltonian:
         magnetization  : int
             Magnetization of the input configuration
         """
-        return (bs.on() - bs.off())
+        return 2 * bs.on() - len(bs)
+    
+    def energy_batch(self, batch: StateBatch):
+        """
+        Compute energies of every configuration in a batch
+    
+        Parameters
+        ----------
+        batch   : StateBatch or np.array
+            configurations, or a 2D array of 0/1 values with one configuration per row
+            
+        Returns
+        -------
+        energies  : np.array
+            Energy of every configuration
+        """
+        if not isinstance(batch, StateBatch):
+            batch = StateBatch(batch)
+        return self.couplings.energy_batch(batch.spins)
+
+    def magnetization_batch(self, batch: StateBatch):
+        """
+        Compute magnetizations of every configuration in a batch
+    
+        Parameters
+        ----------
+        batch   : StateBatch or np.array
+            configurations, or a 2D array of 0/1 values with one configuration per row
+            
+        Returns
+        -------
+        magnetizations  : np.array
+            Magnetization of every configuration
+        """
+        if not isinstance(batch, StateBatch):
+            batch = StateBatch(batch)
+        return 2 * batch.configs.sum(axis=1, dtype=np.int64) - batch.N
     
     def set_mu(self, mus:np.array):
         """
@@ -231,15 +631,33 @@ class IsingHamiltonian:
         return self
 
     
-    def compute_average_values(self, T: float):
+    def compute_average_values(self, T: float, n_workers: int = None, chunk_size: int = None,
+                               method: str = "auto", layers = None):
         """
         Compute average energy, magnetization, heat capacity, and
-        magnetic susceptibility of hamiltonian at a given temp
+        magnetic susceptibility of hamiltonian at a given temp,
+        enumerating all 2^N states in Gray-code order, or one state per orbit
+        of the translation and spin inversion symmetries, with transfer matrices
+        when the graph splits into narrow layers (chains, rings, strips), or by
+        variable elimination when the graph has a low treewidth (trees)
     
         Parameters
         ----------
         T   : float
             temperature to compute at
+        n_workers   : int, optional
+            number of processes to split the enumeration over, serial by
+            default. Only Gray-code enumeration runs in parallel: with "auto"
+            it is ignored when another method is cheaper, and the other
+            methods raise ValueError when it is given
+        chunk_size  : int, optional
+            number of states handed to a worker process at a time, used like n_workers
+        method      : str
+            "enumerate", "symmetric", "transfer", "eliminate", or "auto" for the cheapest.
+            "auto" only picks "symmetric" over enumeration with the numpy kernels and
+            when its states, weighted by their higher run time, are fewer than 2^N
+        layers      : list[np.array], optional
+            sites of every transfer matrix layer, see transfer_matrix_averages
             
         Returns
         -------
@@ -252,43 +670,77 @@ class IsingHamiltonian:
         MS  : float
             Average magnetic susceptibility of the hamiltonian
         """
+        if method not in ("auto", "enumerate") and (n_workers is not None or chunk_size is not None):
+            raise ValueError("n_workers and chunk_size only apply to method=\"enumerate\", not " + str(method))
         
-        bs = BitString(len(self.G))
-
-        E = 0.0
-        M = 0.0
-        EE = 0.0
-        MM = 0.0 
-        Z = 0.0
-        
-        HC = 0.0
-        MS = 0.0
+        order = None
+        if method == "auto":
+            # Every method's cost is estimated up front, enumeration wins once the graph is too wide
+            if layers is None:
+                layers = bfs_layers(self.couplings)
+            costs = {"enumerate": 2 ** self.N,
+                     "transfer": transfer_matrix_cost(layers) + _LAYER_COST * len(layers)}
+            # Every site costs elimination at least one step, the order is only worth finding if that can still win
+            if _SITE_COST * self.N < min(costs.values()):
+                order, width, cost = elimination_order(self.couplings)
+                costs["eliminate"] = _ENTRY_COST * cost + _SITE_COST * self.N
+            method = min(costs, key=costs.get)
+            # Orbit enumeration is only timed against the numpy kernels, numba's Gray enumeration is left alone
+            if (method == "enumerate" and 1 < self.N <= 62 and kernels.get_backend() == "numpy"
+                    and symmetric_cost(self.couplings, weighted=True) < costs[method]):
+                method = "symmetric"
         
-        k = 1
-        beta = 1/(k*T)
- 
-        for i in range((2**len(bs))):
-            bs.set_integer_config(i)
-            curr_e = self.energy(bs)
-            
-            temp = (np.exp(-beta*curr_e))
-            
-            Z += temp
-            
-            E += curr_e*temp
-            M += (bs.on() - bs.off())*temp
-            EE += (curr_e**2)*temp
-            MM += ((bs.on() - bs.off())**2)*temp
+        if method == "transfer":
+            return transfer_matrix_averages(self.couplings, T, layers)
+        if method == "eliminate":
+            return elimination_averages(self.couplings, T, order)
+        if method == "symmetric":
+            return symmetric_averages(self.couplings, T)
+        if method == "enumerate":
+            return exact_averages(self.couplings, T, n_workers=n_workers, chunk_size=chunk_size)
+        raise ValueError("unknown exact method: " + str(method))
+    
+    def density_of_states(self):
+        """
+        Return the joint density of states of energy and magnetization,
+        enumerated once and cached until the couplings change
+    
+        Returns
+        -------
+        dos  : DensityOfStates
+            histogram of (energy, magnetization) over all 2^N states
+        """
+        # Reading the couplings first drops the histogram when nodes or edges of G changed
+        couplings = self.couplings
+        if self._dos is None:
+            self._dos = DensityOfStates.from_couplings(couplings)
+        return self._dos
+
+    def sweep_average_values(self, T, h=0.0):
+        """
+        Compute average energy, magnetization, heat capacity, and
+        magnetic susceptibility for whole arrays of temperatures and
+        additional uniform fields by reweighting the density of states
+    
+        Parameters
+        ----------
+        T   : float or np.array
+            temperatures to compute at
+        h   : float or np.array
+            uniform field added to mu, broadcast against T
             
-        E = E / Z
-        M = M / Z
-        EE = EE / Z
-        MM = MM / Z
-        
-        HC = (EE-E**2)*(T**-2)
-        MS = (MM-M**2)*(T**-1)
-        
-        return E, M, HC, MS
+        Returns
+        -------
+        E  : np.array
+            Average energy of the hamiltonian at every (T, h)
+        M  : np.array
+            Average magnetization of the hamiltonian at every (T, h)
+        HC  : np.array
+            Heat capacity of the hamiltonian at every (T, h)
+        MS  : np.array
+            Magnetic susceptibility of the hamiltonian at every (T, h)
+        """
+        return self.density_of_states().averages(T, h)
     
     def delta_e(self, bs:BitString, change_index:int):
         """
@@ -307,22 +759,17 @@ class IsingHamiltonian:
             difference in energy between the two bitstrings
         """
         
-        b = bs.config * -2 + 1
-        delta = 0
-        
-        for neighbor in self.G.neighbors(change_index):
-            delta += -2 * b[change_index] * b[neighbor] * self.G.edges[(change_index, neighbor)]["weight"]
-        
-        delta += -2 * self.mu[change_index] * b[change_index]
-        
-        return delta
+        indices, weights = self.couplings.neighbors(change_index)
+        b = bs.config[change_index] * 2 - 1
+
+        return -2 * b * (np.dot(weights, bs.config[indices] * 2 - 1) + self.couplings.mu[change_index])
     
 class MonteCarlo:
     """
     Class to implement montecarlo functions to compute average values of energy and magnetism
     """
     
-    def __init__(self, ham:IsingHamiltonian):
+    def __init__(self, ham:IsingHamiltonian, seed=None):
         """
         Assign hamiltonian for use
 
@@ -330,10 +777,24 @@ class MonteCarlo:
         ----------
         ham   : IsingHamiltonian
             desired hamiltonian
+        seed  : int or np.random.SeedSequence, optional
+            seed of the random number generator, fresh entropy by default
         """
         self.ham = ham
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng = np.random.default_rng(seed)
+        self.random = RandomBlocks(self.rng)
         
-    def run(self, T:float, n_samples:int, n_burn:int):
+    def _sweep(self, mode:str):
+        """
+        Return the sweep function of a Monte Carlo mode, called as sweep(spins, T, random)
+        """
+        return self.ham.sweep_function(mode)
+        
+    def run(self, T:float, n_samples:int, n_burn:int, recompute_every:int = None, mode:str = "sequential",
+            stream:bool = False, thin:int = 1, observers = None):
         """
         Initialize configuration, i 
         Loop over Monte Carlo steps	    
@@ -346,6 +807,13 @@ class MonteCarlo:
                     Reject 
             Update average values with updated i
         
+        Energy and magnetization are tracked from the accepted flips rather than
+        recomputed after every sweep. With mode="checkerboard" the sites are
+        colored so that no two coupled sites share a color, and each sweep
+        updates one whole color class at a time with array operations.
+        mode="wolff" grows and flips one cluster per sample and
+        mode="swendsen-wang" flips every cluster of a bond configuration.
+        
         Parameters
         ----------
         T   : float
@@ -354,6 +822,18 @@ class MonteCarlo:
             number of samples to run
         n_burn: int
             nuber of samples to burn before saving measurements
+        recompute_every: int, optional
+            recompute energy and magnetization from scratch every this many
+            sweeps to correct floating point drift, never by default
+        mode: str
+            "sequential" to visit sites one at a time, "checkerboard" to update
+            color classes simultaneously, or "wolff"/"swendsen-wang" cluster updates
+        stream: bool
+            feed the samples into a SampleAccumulator instead of returning lists
+        thin: int
+            keep only every thin-th sample after burn-in
+        observers: list[Observer], optional
+            observers notified of the progress, acceptance rate and timing of the run
             
         Returns
         -------
@@ -361,24 +841,382 @@ class MonteCarlo:
             list of average energy values
         M  : list
             list of average magnetization values
+        
+        or, with stream=True,
+        
+        stats  : SampleAccumulator
+            streaming averages and binned errors of the samples
         """    
-        bs = BitString(len(self.ham.G))
+        samples = self.iter_samples(T, n_samples, n_burn, recompute_every=recompute_every, mode=mode, thin=thin,
+                                    observers=observers)
+        
+        if stream:
+            stats = SampleAccumulator(T)
+            for E, M in samples:
+                stats.add(E, M)
+            return stats
+        
         E = []
         M = []
+        for batch_E, batch_M in samples:
+            E.extend(batch_E.tolist())
+            M.extend(batch_M.tolist())
+        
+        return E, M
+
+    def run_adaptive(self, T:float, target_errors, max_samples:int = 10**6, check_every:int = 1000,
+                     recompute_every:int = None, mode:str = "sequential", observers = None):
+        """
+        Sample until the standard errors of the average energy, magnetization,
+        heat capacity and susceptibility, corrected for autocorrelation, are
+        within `target_errors`, instead of running a fixed number of samples.
+        The burn-in is detected from the traces (see detect_equilibration).
         
-        for i in range(n_samples):            
-            for j in range(len(bs)):
-                delta = self.ham.delta_e(bs, j)
+        The traces are analysed every `check_every` samples at first and then
+        at intervals growing with the trace length, so the analysis costs a
+        bounded fraction of the run.
+        
+        Parameters
+        ----------
+        T   : float
+            temperature to compute at
+        target_errors: sequence
+            largest acceptable standard error of E, M, HC and MS, None for no target
+        max_samples: int
+            largest number of samples to run
+        check_every: int
+            number of samples between the first checks of the errors
+        recompute_every: int, optional
+            recompute energy and magnetization from scratch every this many sweeps
+        mode: str
+            sweep mode, as in `run`
+        observers: list[Observer], optional
+            observers notified of the progress of the run
+            
+        Returns
+        -------
+        analysis  : SampleAnalysis
+            averages and errors of the samples after the detected burn-in,
+            `analysis.meets(target_errors)` is False if max_samples ran out first
+        """
+        E = []
+        M = []
+        n = 0
+        analysis = None
+        next_check = check_every
+        samples = self.iter_samples(T, max_samples, 0, batch_size=check_every, recompute_every=recompute_every,
+                                    mode=mode, observers=observers)
+        for batch_E, batch_M in samples:
+            E.append(batch_E)
+            M.append(batch_M)
+            n += len(batch_E)
+            if n < next_check and n < max_samples:
+                continue
+            
+            E = [np.concatenate(E)]
+            M = [np.concatenate(M)]
+            analysis = SampleAnalysis(E[0], M[0], T)
+            if analysis.meets(target_errors):
+                samples.close()
+                break
+            next_check = max(n + check_every, int(1.25 * n))
+        
+        if analysis is None:
+            # No sample was run, the analysis of the empty traces has NaN averages and errors
+            analysis = SampleAnalysis(np.zeros(0), np.zeros(0), T)
+        return analysis
+
+    def iter_samples(self, T:float, n_samples:int, n_burn:int, batch_size:int = 1024, recompute_every:int = None,
+                     mode:str = "sequential", thin:int = 1, observers = None):
+        """
+        Generator version of `run` that yields the samples in batches of
+        NumPy arrays, so they can be consumed lazily in constant memory
+        
+        Parameters
+        ----------
+        T   : float
+            temperature to compute at
+        n_samples: int
+            number of samples to run
+        n_burn: int
+            nuber of samples to burn before saving measurements
+        batch_size: int
+            number of samples in every yielded batch, the last one may be shorter
+        recompute_every: int, optional
+            recompute energy and magnetization from scratch every this many sweeps
+        mode: str
+            sweep mode, as in `run`
+        thin: int
+            keep only every thin-th sample after burn-in
+        observers: list[Observer], optional
+            observers notified every `observer.every` sweeps, the run is only
+            timed when observers are given
+            
+        Yields
+        ------
+        E  : np.array
+            batch of energy samples
+        M  : np.array
+            batch of magnetization samples
+        """
+        E = np.zeros(batch_size)
+        M = np.zeros(batch_size, dtype=np.int64)
+        n = 0
+        
+        spins = -np.ones(self.ham.N)
+        for i, curr_e, curr_m in self._sweeps(T, n_samples, n_burn, spins, recompute_every=recompute_every,
+                                              mode=mode, observers=observers):
+            if i >= n_burn and (i - n_burn) % thin == 0:
+                E[n] = curr_e
+                M[n] = curr_m
+                n += 1
+                if n == batch_size:
+                    yield E.copy(), M.copy()
+                    n = 0
+        
+        if n:
+            yield E[:n].copy(), M[:n].copy()
+
+    def _sweeps(self, T:float, n_samples:int, n_burn:int, spins, start:int = 0, recompute_every:int = None,
+                mode:str = "sequential", observers = None):
+        """
+        Run sweeps `start` to `n_samples` on `spins` in place, yielding the
+        sweep index with the tracked energy and magnetization after every
+        sweep. Time spent by the caller between sweeps counts as measurement.
+        """
+        sweep = self._sweep(mode)
+        curr_e = self.ham.spin_energy(spins)
+        curr_m = int(spins.sum())
+        
+        if observers:
+            status = RunStatus(T, n_samples, n_burn, mode, self.ham.N, start)
+            for observer in observers:
+                observer.start(status)
+        
+        for i in range(start, n_samples):
+            if observers:
+                proposed = time.perf_counter()
+            delta_e, delta_m, flipped = sweep(spins, T, self.random)
+            if observers:
+                measured = time.perf_counter()
+            curr_e += delta_e
+            curr_m += delta_m
+            
+            if recompute_every and (i + 1) % recompute_every == 0:
+                curr_e = self.ham.spin_energy(spins)
+                curr_m = int(spins.sum())
+            
+            yield i, curr_e, curr_m
+            
+            if observers:
+                status.record(flipped, measured - proposed, time.perf_counter() - measured, curr_e, curr_m)
+                for observer in observers:
+                    if (i + 1) % observer.every == 0:
+                        observer.update(status)
+        
+        if observers:
+            for observer in observers:
+                observer.finish(status)
+
+    def run_checkpointed(self, T:float, n_samples:int, n_burn:int, checkpoint:str, checkpoint_every:int = 1000,
+                         output:str = None, store_configs:bool = False, recompute_every:int = None,
+                         mode:str = "sequential", thin:int = 1, observers = None):
+        """
+        Version of `run` for long jobs, which saves its state to `checkpoint`
+        every `checkpoint_every` sweeps and resumes from that file when it
+        already exists, so a killed job continues where it stopped when it
+        is started again with the same arguments.
+        
+        Samples are kept in streaming accumulators and, if `output` is given,
+        written to a preallocated memory-mapped .npy file (see SampleWriter)
+        instead of being held in memory.
+        
+        Parameters
+        ----------
+        T   : float
+            temperature to compute at
+        n_samples: int
+            number of samples to run
+        n_burn: int
+            nuber of samples to burn before saving measurements
+        checkpoint: str
+            checkpoint file, created or resumed from
+        checkpoint_every: int
+            number of sweeps between checkpoints
+        output: str, optional
+            .npy file receiving the E and M of every kept sample
+        store_configs: bool
+            also write the configuration of every kept sample to `output`
+        recompute_every: int, optional
+            recompute energy and magnetization from scratch every this many sweeps
+        mode: str
+            sweep mode, as in `run`
+        thin: int
+            keep only every thin-th sample after burn-in
+        observers: list[Observer], optional
+            observers notified of the progress of the run
+            
+        Returns
+        -------
+        stats  : SampleAccumulator
+            streaming averages and binned errors of the samples
+        """
+        settings = dict(T=T, n_samples=n_samples, n_burn=n_burn, mode=mode, thin=thin,
+                        recompute_every=recompute_every, output=output, store_configs=store_configs)
+        resume = os.path.exists(checkpoint)
+        if resume:
+            state = Checkpoint.load(checkpoint)
+            if state.settings != settings or len(state.config) != self.ham.N:
+                raise ValueError("checkpoint was written by a different run: " + str(checkpoint))
+            self.random = state.random
+            self.rng = state.random.rng
+        else:
+            state = Checkpoint(settings, 0, BitString(self.ham.N), self.random, SampleAccumulator(T))
+        
+        writer = None
+        if output is not None:
+            writer = SampleWriter(output, len(range(n_burn, n_samples, thin)), self.ham.N, store_configs, resume)
+        
+        spins = 2.0 * state.config.config - 1
+        E = []
+        M = []
+        for i, curr_e, curr_m in self._sweeps(T, n_samples, n_burn, spins, start=state.sweep,
+                                              recompute_every=recompute_every, mode=mode, observers=observers):
+            if i >= n_burn and (i - n_burn) % thin == 0:
+                if writer is not None:
+                    writer.write(state.n_written + len(E), curr_e, curr_m, spins)
+                E.append(curr_e)
+                M.append(curr_m)
+            
+            if (i + 1) % checkpoint_every == 0 or i + 1 == n_samples:
+                if writer is not None:
+                    writer.flush()
+                state.stats.add(E, M)
+                state.n_written += len(E)
+                state.sweep = i + 1
+                state.config.set_config(spins > 0)
+                state.save(checkpoint)
+                E = []
+                M = []
+        
+        return state.stats
+
+    def run_chains(self, T:float, n_samples:int, n_burn:int, n_chains:int = 4, n_workers:int = None, **kwargs):
+        """
+        Run independent chains, each with its own random stream spawned from
+        the seed of this MonteCarlo, optionally on a process pool
+        
+        Parameters
+        ----------
+        T   : float
+            temperature to compute at
+        n_samples: int
+            number of samples to run in each chain
+        n_burn: int
+            nuber of samples to burn before saving measurements
+        n_chains: int
+            number of independent chains
+        n_workers: int, optional
+            number of worker processes, chains run serially by default
+        kwargs:
+            further options passed on to `run`
+            
+        Returns
+        -------
+        results  : ChainResults
+            per-chain traces with merged means, standard errors and R-hat
+        """
+        tasks = [(self.ham, seed, T, n_samples, n_burn, kwargs) for seed in self.seed_sequence.spawn(n_chains)]
+        
+        if n_workers is None or n_workers <= 1:
+            traces = [_run_chain(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(n_workers) as pool:
+                traces = list(pool.map(_run_chain, tasks))
+        
+        E, M = zip(*traces)
+        return ChainResults(E, M)
                                 
-                if delta <= 0 or np.exp(-delta / T) > rand.random():
-                    bs.flip_site(j)
+    
+    def run_tempering(self, Ts, n_samples:int, n_burn:int, swap_every:int = 1, mode:str = "sequential",
+                      adapt:bool = False, adapt_every:int = 10, adapt_rate:float = .5):
+        """
+        Parallel tempering: run one replica per temperature and periodically
+        attempt to swap the configurations of neighboring temperatures,
+        accepting with probability min(1, exp((1/T_k - 1/T_k+1) (E_k - E_k+1)))
+        
+        Parameters
+        ----------
+        Ts   : array_like
+            temperature ladder
+        n_samples: int
+            number of sweeps to run
+        n_burn: int
+            nuber of sweeps to burn before saving measurements
+        swap_every: int
+            attempt swaps every this many sweeps, alternating between even and odd pairs
+        mode: str
+            sweep mode of every replica, as in `run`
+        adapt: bool
+            adjust the interior temperatures during burn-in to even out the
+            swap acceptance rates, keeping the lowest and highest fixed
+        adapt_every: int
+            number of swap attempts between ladder adjustments
+        adapt_rate: float
+            step size of the ladder adjustment
+            
+        Returns
+        -------
+        results  : TemperingResults
+            final ladder, E/M traces at every temperature and swap acceptance rates
+        """
+        Ts = np.sort(np.asarray(Ts, dtype=float))
+        R = len(Ts)
+        sweep = self._sweep(mode)
+        
+        spins = [-np.ones(self.ham.N) for r in range(R)]
+        curr_e = [self.ham.spin_energy(s) for s in spins]
+        curr_m = [int(s.sum()) for s in spins]
+        E = [[] for r in range(R)]
+        M = [[] for r in range(R)]
+        accepted = np.zeros(max(R - 1, 0))
+        attempted = np.zeros(max(R - 1, 0))
+        n_swaps = 0
+        
+        for i in range(n_samples):
+            if i == n_burn:
+                accepted[:] = 0
+                attempted[:] = 0
+            
+            for r in range(R):
+                delta_e, delta_m, flipped = sweep(spins[r], Ts[r], self.random)
+                curr_e[r] += delta_e
+                curr_m[r] += delta_m
+            
+            if (i + 1) % swap_every == 0:
+                for k in range(n_swaps % 2, R - 1, 2):
+                    attempted[k] += 1
+                    delta = (1 / Ts[k] - 1 / Ts[k + 1]) * (curr_e[k] - curr_e[k + 1])
+                    if delta >= 0 or np.exp(delta) > self.random():
+                        accepted[k] += 1
+                        spins[k], spins[k + 1] = spins[k + 1], spins[k]
+                        curr_e[k], curr_e[k + 1] = curr_e[k + 1], curr_e[k]
+                        curr_m[k], curr_m[k + 1] = curr_m[k + 1], curr_m[k]
+                n_swaps += 1
+                
+                if adapt and i < n_burn and R > 2 and n_swaps % adapt_every == 0:
+                    rates = accepted / np.maximum(attempted, 1)
+                    gaps = np.diff(Ts) * np.exp(adapt_rate * (rates - rates.mean()))
+                    Ts[1:-1] = Ts[0] + np.cumsum(gaps * (Ts[-1] - Ts[0]) / gaps.sum())[:-1]
+                    accepted[:] = 0
+                    attempted[:] = 0
             
             if i >= n_burn:
-                E.append(self.ham.energy(bs))
-                M.append(self.ham.magnetization(bs))
+                for r in range(R):
+                    E[r].append(curr_e[r])
+                    M[r].append(curr_m[r])
         
-        return E, M
-                                
+        return TemperingResults(Ts, E, M, accepted / np.maximum(attempted, 1))
     
     def flip_prob(self, T:float, i_en:float, j_en:float):
         """
@@ -406,6 +1244,14 @@ class MonteCarlo:
                     
                     
 
+def _run_chain(task):
+    """
+    Run a single Monte Carlo chain in a worker process
+    """
+    ham, seed, T, n_samples, n_burn, kwargs = task
+    return MonteCarlo(ham, seed).run(T, n_samples, n_burn, **kwargs)
+
+
 if __name__ == "__main__":
     # Do something if this file is invoked on its own
     print("Energy Package")
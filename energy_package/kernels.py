@@ -0,0 +1,294 @@
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+_backend = None
+
+
+def available_backends():
+    """
+    Return the kernel backends usable in this environment
+
+    Returns
+    -------
+    backends : list[str]
+        "numpy" always, and "numba" when Numba is installed
+    """
+    return ["numpy", "numba"] if numba is not None else ["numpy"]
+
+
+def set_backend(name: str = "auto"):
+    """
+    Select the backend of the sweep and enumeration kernels
+
+    Parameters
+    ----------
+    name    : str
+        "numba", "numpy", or "auto" for numba when it is installed
+    """
+    global _backend
+    if name == "auto":
+        name = "numba" if numba is not None else "numpy"
+    if name not in available_backends():
+        raise ValueError("kernel backend not available: " + str(name))
+    _backend = name
+
+
+def get_backend():
+    """
+    Return the selected backend, chosen from the ENERGY_PACKAGE_BACKEND
+    environment variable (default "auto") on first use
+
+    Returns
+    -------
+    name : str
+        "numba" or "numpy"
+    """
+    if _backend is None:
+        set_backend(os.environ.get("ENERGY_PACKAGE_BACKEND", "auto"))
+    return _backend
+
+
+def _metropolis_kernel(indptr, indices, weights, mu, spins, T, draws, q, K, acceptance):
+    """
+    Sequential Metropolis sweep over the CSR couplings, see Couplings.metropolis_sweep
+    """
+    delta_e = 0.0
+    delta_m = 0
+    flipped = 0
+    for i in range(len(spins)):
+        field = mu[i]
+        for p in range(indptr[i], indptr[i + 1]):
+            field += weights[p] * spins[indices[p]]
+        delta = -2 * spins[i] * field
+
+        if len(acceptance):
+            accept = acceptance[int(np.rint(-delta / (2 * q))) + K] > draws[i]
+        else:
+            accept = delta <= 0 or np.exp(-delta / T) > draws[i]
+
+        if accept:
+            delta_e += delta
+            delta_m -= 2 * int(spins[i])
+            flipped += 1
+            spins[i] = -spins[i]
+    return delta_e, delta_m, flipped
+
+
+def _gray_kernel(indptr, indices, weights, mu, start, stop, beta):
+    """
+    Walk the Gray-code states start to stop one flip at a time and return
+    their log-domain partial sums, see exact.block_moments
+    """
+    N = len(mu)
+    spins = np.empty(N)
+    code = start ^ (start >> 1)
+    for i in range(N):
+        spins[i] = 2 * ((code >> i) & 1) - 1
+
+    field = np.zeros(N)
+    energy = 0.0
+    mag = 0.0
+    for i in range(N):
+        for p in range(indptr[i], indptr[i + 1]):
+            field[i] += weights[p] * spins[indices[p]]
+        energy += spins[i] * (field[i] / 2 + mu[i])
+        mag += spins[i]
+
+    shift = energy
+    Z = E = EE = M = MM = 0.0
+    for r in range(start, stop):
+        if energy < shift:
+            scale = np.exp(-beta * (shift - energy))
+            Z *= scale
+            E *= scale
+            EE *= scale
+            M *= scale
+            MM *= scale
+            shift = energy
+
+        w = np.exp(-beta * (energy - shift))
+        Z += w
+        E += w * energy
+        EE += w * energy * energy
+        M += w * mag
+        MM += w * mag * mag
+
+        if r + 1 == stop:
+            break
+
+        # Gray code r -> r+1 flips the bit at the lowest set bit of r+1
+        x = r + 1
+        q = 0
+        while x & 1 == 0:
+            x >>= 1
+            q += 1
+
+        s = spins[q]
+        energy += -2 * s * (field[q] + mu[q])
+        mag -= 2 * s
+        for p in range(indptr[q], indptr[q + 1]):
+            field[indices[p]] -= 2 * s * weights[p]
+        spins[q] = -s
+
+    return np.log(Z) - beta * shift, E / Z, EE / Z, M / Z, MM / Z
+
+
+def _wang_landau_kernel(indptr, indices, weights, mu, spins, energy, mag, sites, draws,
+                        log_g, hist, visits, sum_m, sum_mm, e_min, width, lo, hi, log_f):
+    """
+    Wang-Landau single-flip steps restricted to the energy bins lo to hi,
+    see WangLandau. A walker outside the window only accepts flips that do
+    not take it further away, and records nothing until it is inside.
+    """
+    b = int(np.floor((energy - e_min) / width + .5))
+    for t in range(len(sites)):
+        i = sites[t]
+        field = mu[i]
+        for p in range(indptr[i], indptr[i + 1]):
+            field += weights[p] * spins[indices[p]]
+        delta = -2 * spins[i] * field
+        b_new = int(np.floor((energy + delta - e_min) / width + .5))
+
+        if lo <= b < hi:
+            accept = lo <= b_new < hi and (log_g[b] >= log_g[b_new] or np.exp(log_g[b] - log_g[b_new]) > draws[t])
+        else:
+            distance = lo - b if b < lo else b - hi + 1
+            distance_new = lo - b_new if b_new < lo else (b_new - hi + 1 if b_new >= hi else 0)
+            accept = distance_new <= distance
+
+        if accept:
+            energy += delta
+            mag -= 2 * spins[i]
+            spins[i] = -spins[i]
+            b = b_new
+
+        if lo <= b < hi:
+            log_g[b] += log_f
+            hist[b] += 1
+            visits[b] += 1
+            sum_m[b] += mag
+            sum_mm[b] += mag * mag
+    return energy, mag
+
+
+if numba is not None:
+    # cache=True keeps the compiled kernels on disk, so new worker processes load them instead of recompiling
+    _metropolis_kernel = numba.njit(cache=True)(_metropolis_kernel)
+    _gray_kernel = numba.njit(cache=True)(_gray_kernel)
+    _wang_landau_kernel = numba.njit(cache=True)(_wang_landau_kernel)
+
+
+def metropolis_sweep(couplings, spins, T: float, draws, table):
+    """
+    Compiled sequential Metropolis sweep
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    spins       : np.ndarray
+        float spin configuration of +1/-1 values, updated in place
+    T           : float
+        temperature of the sweep
+    draws       : np.ndarray
+        one uniform random number per site
+    table       : tuple or None
+        acceptance table from Couplings.acceptance_table
+
+    Returns
+    -------
+    delta_e : float
+        energy change of the sweep
+    delta_m : int
+        magnetization change of the sweep
+    flipped : int
+        number of sites flipped
+    """
+    q, K, acceptance = table if table is not None else (1.0, 0, np.zeros(0))
+    return _metropolis_kernel(couplings.indptr, couplings.indices, couplings.weights, couplings.mu,
+                              spins, float(T), np.asarray(draws, dtype=float), float(q), int(K), acceptance)
+
+
+def gray_moments(couplings, start: int, stop: int, beta: float):
+    """
+    Compiled Gray-code enumeration of the states start to stop
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian, at most 62 sites
+    start       : int
+        index of the first state in Gray-code order
+    stop        : int
+        index one past the last state
+    beta        : float
+        inverse temperature
+
+    Returns
+    -------
+    moments : tuple
+        log Z and Boltzmann averages of E, E^2, M and M^2 over the states
+    """
+    return _gray_kernel(couplings.indptr, couplings.indices, couplings.weights, couplings.mu,
+                        int(start), int(stop), float(beta))
+
+
+def wang_landau_steps(couplings, spins, energy: float, mag: float, sites, draws, histograms, bins, log_f: float):
+    """
+    Wang-Landau single-flip steps, compiled with the numba backend
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    spins       : np.ndarray
+        float spin configuration of +1/-1 values, updated in place
+    energy      : float
+        energy of the configuration
+    mag         : float
+        magnetization of the configuration
+    sites       : np.ndarray
+        site proposed at every step
+    draws       : np.ndarray
+        one uniform random number per step
+    histograms  : tuple
+        (log_g, hist, visits, sum_m, sum_mm) arrays over the energy bins, updated in place
+    bins        : tuple
+        (e_min, width, lo, hi): energy of bin 0, bin width and the window of bins lo to hi
+    log_f       : float
+        modification factor added to log_g at every step
+
+    Returns
+    -------
+    energy  : float
+        energy after the steps
+    mag     : float
+        magnetization after the steps
+    """
+    e_min, width, lo, hi = bins
+    return _wang_landau_kernel(couplings.indptr, couplings.indices, couplings.weights, couplings.mu,
+                               spins, float(energy), float(mag), np.asarray(sites, dtype=np.int64),
+                               np.asarray(draws, dtype=float), *histograms,
+                               float(e_min), float(width), int(lo), int(hi), float(log_f))
+
+
+def warm_up():
+    """
+    Compile, or load from the on-disk cache, every kernel of the selected backend
+    """
+    if get_backend() != "numba":
+        return
+    from .couplings import Couplings
+    couplings = Couplings(2, [0], [1], [1.0])
+    metropolis_sweep(couplings, -np.ones(2), 1.0, np.zeros(2), None)
+    metropolis_sweep(couplings, -np.ones(2), 1.0, np.zeros(2), couplings.acceptance_table(1.0))
+    gray_moments(couplings, 0, 4, 1.0)
+    wang_landau_steps(couplings, -np.ones(2), 1.0, -2.0, np.zeros(1, dtype=np.int64), np.zeros(1),
+                      (np.zeros(3), np.zeros(3), np.zeros(3), np.zeros(3), np.zeros(3)), (-1.0, 1.0, 0, 3), 1.0)
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+def hypercubic_edges(shape, periodic: bool = True):
+    """
+    Return the nearest-neighbor edges of a hypercubic lattice
+
+    Sites are numbered in C order of `shape`, so site (x, y, z) of an
+    (Lx, Ly, Lz) lattice is x*Ly*Lz + y*Lz + z. With periodic boundaries a
+    side of length 2 gets a single edge per pair rather than two, and sides
+    of length 1 get none.
+
+    Parameters
+    ----------
+    shape       : int or tuple[int]
+        side lengths of the lattice, an int for a chain
+    periodic    : bool
+        wrap every side around
+
+    Returns
+    -------
+    edge_i : np.ndarray
+        first site of every edge
+    edge_j : np.ndarray
+        second site of every edge
+    """
+    shape = tuple(np.atleast_1d(shape).astype(int).tolist())
+    sites = np.arange(int(np.prod(shape)), dtype=np.int64).reshape(shape)
+
+    edge_i, edge_j = [], []
+    for axis, L in enumerate(shape):
+        if L < 2:
+            continue
+        if periodic and L > 2:
+            neighbor = np.roll(sites, -1, axis=axis)
+            first = sites
+        else:
+            first = np.take(sites, np.arange(L - 1), axis=axis)
+            neighbor = np.take(sites, np.arange(1, L), axis=axis)
+        edge_i.append(first.ravel())
+        edge_j.append(neighbor.ravel())
+
+    if not edge_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(edge_i), np.concatenate(edge_j)
+
+
+def chain_edges(L: int, periodic: bool = True):
+    """
+    Return the edges of a 1D chain, a ring with periodic boundaries
+
+    Parameters
+    ----------
+    L           : int
+        number of sites
+    periodic    : bool
+        join the last site to the first
+
+    Returns
+    -------
+    edge_i : np.ndarray
+        first site of every edge
+    edge_j : np.ndarray
+        second site of every edge
+    """
+    return hypercubic_edges((L,), periodic)
+
+
+def square_edges(Lx: int, Ly: int, periodic: bool = True):
+    """
+    Return the edges of a 2D square lattice, see hypercubic_edges
+
+    Parameters
+    ----------
+    Lx          : int
+        number of rows
+    Ly          : int
+        number of columns
+    periodic    : bool
+        wrap both sides around
+
+    Returns
+    -------
+    edge_i : np.ndarray
+        first site of every edge
+    edge_j : np.ndarray
+        second site of every edge
+    """
+    return hypercubic_edges((Lx, Ly), periodic)
+
+
+def cubic_edges(Lx: int, Ly: int, Lz: int, periodic: bool = True):
+    """
+    Return the edges of a 3D simple cubic lattice, see hypercubic_edges
+
+    Parameters
+    ----------
+    Lx          : int
+        first side length
+    Ly          : int
+        second side length
+    Lz          : int
+        third side length
+    periodic    : bool
+        wrap every side around
+
+    Returns
+    -------
+    edge_i : np.ndarray
+        first site of every edge
+    edge_j : np.ndarray
+        second site of every edge
+    """
+    return hypercubic_edges((Lx, Ly, Lz), periodic)
@@ -0,0 +1,227 @@
+import logging
+import sys
+import time
+
+
+class RunStatus:
+    """
+    Class to hold the running metrics of a Monte Carlo run, passed to observers
+    """
+
+    def __init__(self, T: float, n_samples: int, n_burn: int, mode: str, N: int, sweep: int = 0):
+        """
+        Start the metrics of a run
+
+        Parameters
+        ----------
+        T           : float
+            temperature of the run
+        n_samples   : int
+            total number of sweeps of the run
+        n_burn      : int
+            number of burn-in sweeps
+        mode        : str
+            sweep mode of the run
+        N           : int
+            number of sites
+        sweep       : int
+            number of sweeps already completed, when a run is resumed
+        """
+        self.T = T
+        self.n_samples = n_samples
+        self.n_burn = n_burn
+        self.mode = mode
+        self.N = N
+        self.sweep = sweep
+        self.first_sweep = sweep
+        self.flipped = 0
+        self.proposal_time = 0.0
+        self.measurement_time = 0.0
+        self.energy = None
+        self.magnetization = None
+        self.start_time = time.perf_counter()
+
+    def record(self, flipped: int, proposal_time: float, measurement_time: float, energy: float, magnetization: int):
+        """
+        Add the metrics of one sweep
+        """
+        self.sweep += 1
+        self.flipped += flipped
+        self.proposal_time += proposal_time
+        self.measurement_time += measurement_time
+        self.energy = energy
+        self.magnetization = magnetization
+
+    @property
+    def elapsed(self):
+        """
+        Wall time since the start of the run, in seconds
+        """
+        return time.perf_counter() - self.start_time
+
+    @property
+    def acceptance_rate(self):
+        """
+        Fraction of sites flipped per sweep, the Metropolis acceptance rate for single-spin modes
+        """
+        sweeps = self.sweep - self.first_sweep
+        return self.flipped / (sweeps * self.N) if sweeps and self.N else 0.0
+
+    @property
+    def sweeps_per_second(self):
+        """
+        Sweeps completed per second of wall time
+        """
+        return (self.sweep - self.first_sweep) / self.elapsed
+
+    @property
+    def progress(self):
+        """
+        Fraction of the sweeps completed
+        """
+        return self.sweep / self.n_samples if self.n_samples else 1.0
+
+
+class Observer:
+    """
+    Base class of Monte Carlo run observers
+
+    `update` is called every `every` sweeps, `start` and `finish` once per run.
+    Subclasses override the hooks they need.
+    """
+
+    def __init__(self, every: int = 100):
+        """
+        Set how often the observer is called
+
+        Parameters
+        ----------
+        every   : int
+            number of sweeps between calls to `update`
+        """
+        self.every = every
+
+    def start(self, status: RunStatus):
+        pass
+
+    def update(self, status: RunStatus):
+        pass
+
+    def finish(self, status: RunStatus):
+        pass
+
+
+class LoggingObserver(Observer):
+    """
+    Log the run metrics through the `logging` module
+    """
+
+    def __init__(self, every: int = 100, logger: logging.Logger = None, level: int = logging.INFO):
+        """
+        Set the logger
+
+        Parameters
+        ----------
+        every   : int
+            number of sweeps between log records
+        logger  : logging.Logger, optional
+            logger to write to, the package logger by default
+        level   : int
+            level of the log records
+        """
+        super().__init__(every)
+        self.logger = logger if logger is not None else logging.getLogger("energy_package")
+        self.level = level
+
+    def start(self, status: RunStatus):
+        self.logger.log(self.level, "Monte Carlo run started: T=%g, %d sweeps (%d burn-in), mode=%s",
+                        status.T, status.n_samples, status.n_burn, status.mode)
+
+    def update(self, status: RunStatus):
+        self.logger.log(self.level, "sweep %d/%d: acceptance %.3f, %.1f sweeps/s, E=%g, M=%d",
+                        status.sweep, status.n_samples, status.acceptance_rate, status.sweeps_per_second,
+                        status.energy, status.magnetization)
+
+    def finish(self, status: RunStatus):
+        self.logger.log(self.level, "Monte Carlo run finished: %d sweeps in %.2fs",
+                        status.sweep, status.elapsed)
+
+
+class ProgressObserver(Observer):
+    """
+    Write a progress line with the estimated time remaining
+    """
+
+    def __init__(self, every: int = 100, stream=None):
+        """
+        Set the output stream
+
+        Parameters
+        ----------
+        every   : int
+            number of sweeps between progress lines
+        stream  : file, optional
+            stream to write to, sys.stderr by default
+        """
+        super().__init__(every)
+        self.stream = stream
+
+    def update(self, status: RunStatus):
+        rate = status.sweeps_per_second
+        eta = (status.n_samples - status.sweep) / rate if rate else float("inf")
+        stream = self.stream if self.stream is not None else sys.stderr
+        stream.write("sweep %d/%d (%.0f%%), %.1f sweeps/s, eta %.0fs\n"
+                     % (status.sweep, status.n_samples, 100 * status.progress, rate, eta))
+
+
+class TimingObserver(Observer):
+    """
+    Record a timing profile of the run and a history of its metrics
+    """
+
+    def __init__(self, every: int = 100):
+        """
+        Start with an empty history
+
+        Parameters
+        ----------
+        every   : int
+            number of sweeps between history entries
+        """
+        super().__init__(every)
+        self.history = []
+        self.status = None
+        self.total_time = None
+        self.proposal_time = None
+        self.measurement_time = None
+
+    def start(self, status: RunStatus):
+        self.status = status
+
+    def update(self, status: RunStatus):
+        self.history.append((status.sweep, status.acceptance_rate, status.sweeps_per_second))
+
+    def finish(self, status: RunStatus):
+        self.total_time = status.elapsed
+        self.proposal_time = status.proposal_time
+        self.measurement_time = status.measurement_time
+
+    def profile(self):
+        """
+        Return where the time of the run went, so far while the run is going
+
+        Returns
+        -------
+        profile : dict
+            seconds spent in proposals (sweeps), in measurement, and elsewhere
+        """
+        if self.total_time is not None:
+            total, proposal, measurement = self.total_time, self.proposal_time, self.measurement_time
+        elif self.status is not None:
+            status = self.status
+            total, proposal, measurement = status.elapsed, status.proposal_time, status.measurement_time
+        else:
+            raise RuntimeError("TimingObserver has not observed a run yet")
+        return {"proposal": proposal,
+                "measurement": measurement,
+                "other": total - proposal - measurement}
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class RandomBlocks:
+    """
+    Serve uniform random numbers from large pre-drawn blocks
+
+    Calling an instance behaves like `Generator.random`, but the numbers are
+    drawn `block_size` at a time, so sweeps asking for a few numbers at a time
+    do not pay the generator call overhead every time.
+    """
+
+    def __init__(self, rng: np.random.Generator, block_size: int = 2 ** 16):
+        """
+        Set the generator and block size
+
+        Parameters
+        ----------
+        rng         : np.random.Generator
+            source of the random numbers
+        block_size  : int
+            number of random numbers drawn at a time
+        """
+        self.rng = rng
+        self.block_size = block_size
+        self.block = np.zeros(0)
+        self.pos = 0
+
+    def __call__(self, size: int = None):
+        """
+        Return uniform random numbers in [0, 1)
+
+        Parameters
+        ----------
+        size    : int, optional
+            number of random numbers, a single float by default
+
+        Returns
+        -------
+        random : float or np.ndarray
+            the random numbers
+        """
+        n = 1 if size is None else size
+        if n > self.block_size:
+            return self.rng.random(size)
+        if self.pos + n > len(self.block):
+            self.block = self.rng.random(self.block_size)
+            self.pos = 0
+
+        self.pos += n
+        if size is None:
+            return self.block[self.pos - 1]
+        return self.block[self.pos - n:self.pos]
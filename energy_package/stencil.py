@@ -0,0 +1,306 @@
+import itertools
+
+import numpy as np
+
+from .couplings import _cached_acceptance_table, _discrete_unit
+from .functions import IsingHamiltonian, BitString, StateBatch
+from .lattice import hypercubic_edges
+
+
+class LatticeHamiltonian(IsingHamiltonian):
+    """
+    Ising hamiltonian of a hypercubic lattice with a uniform coupling J
+
+    Spins are handled as arrays of the lattice shape, and energies, local
+    fields and checkerboard sweeps are computed with shifted-slice stencils
+    instead of neighbor lists, so the sweeps stream through the spins without
+    gathering through index arrays. Checkerboard sweeps of a bipartite
+    lattice never build the couplings. Everything else (exact enumeration,
+    sequential and cluster sweeps) uses the couplings of the same lattice,
+    so the hamiltonian works anywhere an IsingHamiltonian does.
+    """
+
+    def __init__(self, shape, J: float = 1.0, mu=None, periodic: bool = True):
+        """
+        Set up the lattice
+
+        Parameters
+        ----------
+        shape       : int or tuple[int]
+            side lengths of the 1D, 2D or 3D lattice, sites numbered in C order
+        J           : float
+            coupling strength of every nearest-neighbor edge
+        mu          : float or array_like, optional
+            field on every site, or one field for all, all zeros by default
+        periodic    : bool
+            wrap every side around
+        """
+        self.shape = tuple(np.atleast_1d(shape).astype(int).tolist())
+        self.J = float(J)
+        self.periodic = periodic
+        self._set_edges(int(np.prod(self.shape)), *hypercubic_edges(self.shape, periodic), self.J, mu)
+
+        # Sites of even and odd coordinate sum are a valid 2-coloring unless a periodic side is odd
+        self.bipartite = not periodic or all(L % 2 == 0 or L == 1 for L in self.shape)
+        parity = np.indices(self.shape).sum(axis=0).ravel() % 2
+        self._colors = [np.flatnonzero(parity == 0), np.flatnonzero(parity == 1)]
+        self._sublattices = [self._sublattice_offsets(color) for color in (0, 1)]
+        self._tables = {}
+        self._unit = None
+
+    def _sublattice_offsets(self, color: int):
+        """
+        Return the strided sublattices, sites with coordinates x_k = a_k mod 2,
+        that make up a color, each with the stencil terms of its field and
+        the index of its sites in the random numbers the color draws in flat
+        site order
+        """
+        rank = np.zeros(self.shape, dtype=np.int64)
+        rank.ravel()[self._colors[color]] = np.arange(len(self._colors[color]))
+        offsets = []
+        for a in itertools.product((0, 1), repeat=len(self.shape)):
+            index = tuple(slice(o, None, 2) for o in a)
+            if sum(a) % 2 != color or rank[index].size == 0:
+                continue
+            if self.shape[-1] % 2 == 0:
+                # Every row of an even last side holds half its sites in each color, in order
+                draws = (self.shape[:-1] + (self.shape[-1] // 2,), index[:-1] + (slice(None),))
+            else:
+                draws = (None, rank[index])
+            offsets.append((index, self._stencil_terms(a, rank[index].shape), draws))
+        return offsets
+
+    def _stencil_terms(self, a, shape):
+        """
+        Return (to, source) index pairs such that adding lattice[source] to
+        field[to] for every pair gives the neighbor sum on the sublattice of
+        offsets `a`, of the given shape
+        """
+        terms = []
+        for k, L in enumerate(self.shape):
+            if L < 2:
+                continue
+            # Site x = 2i + a_k has its neighbors x - 1 and x + 1 on the sublattice of offset 1 - a_k along k
+            b = 1 - a[k]
+            n, m = shape[k], (L - b + 1) // 2
+            pairs = [(0, 0, min(n, m))]
+            pairs.append((1, 0, min(m, n - 1)) if a[k] == 0 else (0, 1, min(n, m - 1)))
+            if self.periodic and L > 2:
+                pairs.append((0, m - 1, 1) if a[k] == 0 else (n - 1, 0, 1))
+            for to, source, length in pairs:
+                if length <= 0:
+                    continue
+                field_index = [slice(None)] * len(self.shape)
+                field_index[k] = slice(to, to + length)
+                lattice_index = [slice(o, None, 2) for o in a]
+                lattice_index[k] = slice(b + 2 * source, b + 2 * (source + length), 2)
+                terms.append((tuple(field_index), tuple(lattice_index)))
+        return terms
+
+    def invalidate(self):
+        """
+        Drop the compiled couplings and the acceptance tables so they are rebuilt on next use
+        """
+        self._tables = {}
+        self._unit = None
+        return super().invalidate()
+
+    def delta_unit(self, max_levels: int = 4096):
+        """
+        Detect whether every flip energy is a multiple of a common unit, see
+        Couplings.delta_unit, from J, mu and the largest coordination number
+
+        Returns
+        -------
+        unit : tuple or None
+            (q, K), or None if the energies are not discrete enough
+        """
+        degree = sum(2 if L > 2 else 1 for L in self.shape if L > 1)
+        mu = np.broadcast_to(self.mu, (self.N,))
+        reach = degree * abs(self.J) + (np.abs(mu).max() if self.N else 0.0)
+        return _discrete_unit(np.append(mu, self.J), reach, max_levels)
+
+    def acceptance_table(self, T: float):
+        """
+        Return the Metropolis acceptance table at temperature T, if energies
+        are discrete, see Couplings.acceptance_table
+        """
+        # The unit is kept in a list, None is a valid unit for continuous energies
+        if self._unit is None:
+            self._unit = [self.delta_unit()]
+        if self._unit[0] is None:
+            return None
+        return _cached_acceptance_table(self._tables, self._unit[0], T)
+
+    def _axes(self, ndim: int):
+        """
+        Yield the array axis and side length of every lattice direction with neighbors
+        """
+        for axis, L in enumerate(self.shape):
+            if L > 1:
+                yield ndim - len(self.shape) + axis, L
+
+    def _slices(self, ndim: int, axis: int, first, second):
+        """
+        Return index tuples selecting `first` and `second` along one axis
+        """
+        a = [slice(None)] * ndim
+        b = [slice(None)] * ndim
+        a[axis] = first
+        b[axis] = second
+        return tuple(a), tuple(b)
+
+    def local_field(self, spins):
+        """
+        Return the coupling field J sum_j s_j acting on every site
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            spin configuration of +1/-1 values of the lattice shape, or a
+            stack of them with leading batch axes
+
+        Returns
+        -------
+        field : np.ndarray
+            coupling field on every site, in the shape of `spins`
+        """
+        field = np.zeros(spins.shape)
+        for axis, L in self._axes(spins.ndim):
+            lo, hi = self._slices(spins.ndim, axis, slice(None, -1), slice(1, None))
+            field[lo] += spins[hi]
+            field[hi] += spins[lo]
+            if self.periodic and L > 2:
+                first, last = self._slices(spins.ndim, axis, 0, -1)
+                field[first] += spins[last]
+                field[last] += spins[first]
+        return self.J * field
+
+    def spin_energy(self, spins):
+        """
+        Return the energy of spin configurations of the lattice shape
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            spin configuration of +1/-1 values of the lattice shape, or a
+            stack of them with leading batch axes, or a flat configuration
+
+        Returns
+        -------
+        energy : float or np.ndarray
+            energy of every configuration
+        """
+        if spins.ndim == 1:
+            spins = spins.reshape(self.shape)
+        lattice_axes = tuple(range(spins.ndim - len(self.shape), spins.ndim))
+        bonds = np.zeros(spins.shape[:spins.ndim - len(self.shape)])
+        for axis, L in self._axes(spins.ndim):
+            lo, hi = self._slices(spins.ndim, axis, slice(None, -1), slice(1, None))
+            bonds = bonds + (spins[lo] * spins[hi]).sum(axis=lattice_axes)
+            if self.periodic and L > 2:
+                first, last = self._slices(spins.ndim, axis, slice(0, 1), slice(-1, None))
+                bonds = bonds + (spins[first] * spins[last]).sum(axis=lattice_axes)
+        return self.J * bonds + (spins * self.mu.reshape(self.shape)).sum(axis=lattice_axes)
+
+    def energy(self, bs: BitString):
+        """
+        Compute energy of configuration, `bs`, by stencil
+
+        Parameters
+        ----------
+        bs   : Bitstring
+            input configuration
+
+        Returns
+        -------
+        energy  : float
+            Energy of the input configuration
+        """
+        return self.spin_energy((2.0 * bs.config - 1).reshape(self.shape))
+
+    def energy_batch(self, batch: StateBatch):
+        """
+        Compute energies of every configuration in a batch by stencil
+
+        Parameters
+        ----------
+        batch   : StateBatch or np.array
+            configurations, or a 2D array of 0/1 values with one configuration per row
+
+        Returns
+        -------
+        energies  : np.array
+            Energy of every configuration
+        """
+        if not isinstance(batch, StateBatch):
+            batch = StateBatch(batch)
+        return self.spin_energy(batch.spins.reshape((len(batch),) + self.shape))
+
+    def checkerboard_sweep(self, spins, T: float, random=np.random.random):
+        """
+        Metropolis sweep of the even and then the odd sublattice of a
+        bipartite lattice, with the fields of each half computed by stencils
+        over strided views, so only the active half is visited
+
+        Parameters
+        ----------
+        spins   : np.ndarray
+            float spin configuration of +1/-1 values, flat, updated in place
+        T       : float
+            temperature of the sweep
+        random  : callable
+            returns an array of uniform random numbers of a given size
+
+        Returns
+        -------
+        delta_e : float
+            energy change of the sweep
+        delta_m : int
+            magnetization change of the sweep
+        flipped : int
+            number of sites flipped
+        """
+        lattice = spins.reshape(self.shape)
+        mu = np.asarray(self.mu, dtype=float)
+        uniform = mu.ndim == 0 or np.all(mu == mu.flat[0])
+        mu = float(mu.flat[0]) if uniform else mu.reshape(self.shape)
+        table = self.acceptance_table(T)
+        delta_e = 0.0
+        delta_m = 0
+        n_flipped = 0
+        for sites, offsets in zip(self._colors, self._sublattices):
+            # One draw per site in flat order, as the generic checkerboard sweep
+            draws = random(len(sites))
+            for index, terms, (shape, draw_index) in offsets:
+                s = lattice[index]
+                field = np.zeros(s.shape)
+                for to, source in terms:
+                    field[to] += lattice[source]
+
+                # e = s (J field + mu) is minus half the energy change of a flip
+                field *= self.J
+                field += mu if uniform else mu[index]
+                field *= s
+                u = draws.reshape(shape)[draw_index] if shape is not None else draws[draw_index]
+                if table is None:
+                    accept = u < np.exp(np.minimum(2 * field, 0) / T)
+                else:
+                    q, K, acceptance = table
+                    accept = u < acceptance[np.rint(field / q).astype(np.int64) + K]
+
+                # Flips are applied arithmetically, boolean indexing of strided views is slow
+                delta_e -= 2 * np.vdot(field, accept)
+                delta_m -= 2 * int(np.vdot(s, accept))
+                n_flipped += int(np.count_nonzero(accept))
+                s[...] = np.where(accept, -s, s)
+        return delta_e, delta_m, n_flipped
+
+    def sweep_function(self, mode: str):
+        """
+        Return the Monte Carlo sweep of a mode, the stencil sweep for
+        "checkerboard" on a bipartite lattice, see IsingHamiltonian.sweep_function
+        """
+        if mode == "checkerboard" and self.bipartite:
+            return self.checkerboard_sweep
+        return super().sweep_function(mode)
@@ -0,0 +1,342 @@
+import itertools
+
+import numpy as np
+
+from .couplings import Couplings
+from .exact import block_moments, merge_moments
+
+# Run time of symmetric_averages relative to one state of Gray enumeration,
+# both vectorized with numpy, so the ratios rather than the machine's speed
+# matter: building and weighting one candidate state, and testing it against
+# one group element that does not move a whole tile. They only decide
+# between two correct methods, a rough estimate is enough
+_CANDIDATE_COST = 8
+_ELEMENT_COST = 1.5
+
+
+def is_automorphism(couplings: Couplings, perm):
+    """
+    Return whether a permutation of the sites maps every coupling onto a
+    coupling of the same weight and every field onto an equal field
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    perm        : array_like
+        site perm[i] is the image of site i
+
+    Returns
+    -------
+    symmetric : bool
+        True if the hamiltonian is invariant under the permutation
+    """
+    perm = np.asarray(perm, dtype=np.int64)
+    if not np.allclose(couplings.mu[perm], couplings.mu):
+        return False
+
+    def sorted_edges(ei, ej):
+        key = np.minimum(ei, ej) * couplings.N + np.maximum(ei, ej)
+        order = np.argsort(key, kind="stable")
+        return key[order], couplings.edge_w[order]
+
+    key, w = sorted_edges(couplings.edge_i, couplings.edge_j)
+    image_key, image_w = sorted_edges(perm[couplings.edge_i], perm[couplings.edge_j])
+    return np.array_equal(key, image_key) and np.allclose(w, image_w)
+
+
+def _translation(shape, shift):
+    """
+    Return the permutation of the C-ordered sites of a periodic lattice translated by `shift`
+    """
+    sites = np.arange(int(np.prod(shape))).reshape(shape)
+    return np.roll(sites, shift, axis=tuple(range(len(shape)))).ravel().argsort()
+
+
+def _shapes(N: int):
+    """
+    Yield every way of writing N as a lattice of one to three sides of at least two sites
+    """
+    yield (N,)
+    for a in range(2, N):
+        if N % a == 0:
+            yield (a, N // a)
+            for b in range(2, N // a):
+                if (N // a) % b == 0:
+                    yield (a, b, N // a // b)
+
+
+def find_symmetries(couplings: Couplings, shape=None):
+    """
+    Detect the translation and spin inversion symmetries of a hamiltonian
+
+    The sites are read as a periodic lattice of `shape` in C order, or of
+    every shape of one to three sides that multiplies to N, and unit
+    translations along every side are tested with is_automorphism. The
+    translations of the sides that pass form the group; the shape with the
+    largest group wins. Rings of consecutively numbered sites and lattices
+    from hypercubic_edges are found this way. Spin inversion is a symmetry
+    when all fields are zero.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    shape       : tuple[int], optional
+        lattice shape to test, all factorizations of N by default
+
+    Returns
+    -------
+    perms : list[np.ndarray]
+        every site permutation of the group, except the identity
+    inversion : bool
+        True if flipping all spins is a symmetry
+    """
+    N = couplings.N
+    shapes = [tuple(np.atleast_1d(shape).tolist())] if shape is not None else _shapes(N)
+
+    best_shape, best_axes, best_order = None, [], 1
+    for candidate in shapes:
+        unit = np.eye(len(candidate), dtype=int)
+        axes = [axis for axis, L in enumerate(candidate)
+                if L > 1 and is_automorphism(couplings, _translation(candidate, unit[axis]))]
+        order = int(np.prod([candidate[axis] for axis in axes]))
+        if order > best_order:
+            best_shape, best_axes, best_order = candidate, axes, order
+
+    perms = []
+    if best_shape is not None:
+        ranges = [range(L) if axis in best_axes else range(1) for axis, L in enumerate(best_shape)]
+        perms = [_translation(best_shape, shift) for shift in itertools.product(*ranges) if any(shift)]
+    return perms, bool(np.all(couplings.mu == 0))
+
+
+def _bit_shifts(perm):
+    """
+    Return the permutation as (mask, shift) pairs, moving the bits of each mask by the same amount
+    """
+    perm = np.asarray(perm, dtype=np.int64)
+    distance = perm - np.arange(len(perm))
+    return [(int(np.sum(1 << np.flatnonzero(distance == d))), int(d)) for d in np.unique(distance)]
+
+
+def _apply(states, shifts, flip: bool, full: int):
+    """
+    Return the images of integer states under a bit permutation, followed by a flip of all bits
+    """
+    image = np.zeros_like(states)
+    for mask, d in shifts:
+        image |= (states & mask) << d if d >= 0 else (states & mask) >> -d
+    return image ^ full if flip else image
+
+
+def _group(couplings: Couplings, perms, inversion):
+    """
+    Return the elements (perm, bit shifts, flip) of the group including the
+    identity, and whether it contains spin inversion
+    """
+    N = couplings.N
+    if N > 62:
+        raise ValueError("symmetric enumeration is limited to 62 sites")
+    if perms is None or inversion is None:
+        found, found_inversion = find_symmetries(couplings)
+        perms = found if perms is None else perms
+        inversion = found_inversion if inversion is None else inversion
+
+    perms = [np.arange(N)] + [np.asarray(perm, dtype=np.int64) for perm in perms]
+    elements = [(perm, _bit_shifts(perm), False) for perm in perms]
+    if inversion:
+        elements += [(perm, shifts, True) for perm, shifts, flip in elements]
+    return elements, inversion
+
+
+def symmetric_cost(couplings: Couplings, perms=None, inversion=None, weighted: bool = False):
+    """
+    Return the number of states symmetric_averages enumerates
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    perms       : list[array_like], optional
+        site permutations of the group except the identity, found by find_symmetries by default
+    inversion   : bool, optional
+        include spin inversion, found by find_symmetries by default
+    weighted    : bool
+        weight every state by its measured run time relative to one state
+        of Gray enumeration with the numpy kernels, which grows with the
+        group elements that do not move a whole tile
+
+    Returns
+    -------
+    cost : int
+        number of states enumerated, 2^N without symmetries
+    """
+    elements, inversion = _group(couplings, perms, inversion)
+    count, S, tables, others, tops = _tile_size(couplings.N, elements)
+    if weighted:
+        return int(count * (_CANDIDATE_COST + _ELEMENT_COST * len(others)))
+    return count
+
+
+def _tile_tables(N: int, S: int, elements):
+    """
+    Split the group elements by the tile of S consecutive bits they move to
+    the top tile, with the top tile of the image as a table over the values
+    of that tile, and return the elements that do not move a whole tile
+    """
+    values = np.arange(2 ** S, dtype=np.int64)
+    full = (1 << N) - 1
+    top = np.arange(N - S, N)
+    tables = [[] for r in range(N // S)]
+    others = []
+    for perm, shifts, flip in elements:
+        source = np.sort(np.flatnonzero(np.isin(perm, top)))
+        r = source[0] // S
+        if source[0] % S or source[-1] != source[0] + S - 1:
+            others.append((shifts, flip))
+            continue
+        tables[r].append(_apply(values << (r * S), shifts, flip, full) >> (N - S) & (2 ** S - 1))
+    return [np.array(t, dtype=np.int64).reshape(-1, 2 ** S) for t in tables], others
+
+
+def _tile_size(N: int, elements):
+    """
+    Return the number of states enumerated, and the tile size, tables and
+    top tiles, of the tile size that leaves the fewest
+    """
+    best = None
+    for S in range(1, min(N, 10) + 1):
+        if N % S:
+            continue
+        tables, others = _tile_tables(N, S, elements)
+        tops = np.arange(2 ** S)
+        if len(tables[-1]):
+            tops = tops[tables[-1].min(axis=0) >= tops]
+        sizes = np.ones(len(tops))
+        for table in tables[:-1]:
+            sizes *= 2 ** S - np.searchsorted(np.sort(table.min(axis=0)), tops) if len(table) else 2 ** S
+        if best is None or sizes.sum() < best[0]:
+            best = (int(sizes.sum()), S, tables, others, tops)
+    return best
+
+
+def _tile_energies(couplings: Couplings, S: int):
+    """
+    Return the energy of every value of every tile, couplings inside the
+    tile and fields included, and the energy tables of the couplings
+    between every pair of tiles (r, r') over the values v_r * 2^S + v_r'
+    """
+    values = np.arange(2 ** S, dtype=np.int64)
+    spins = ((values[:, None] >> np.arange(S)) & 1) * 2.0 - 1
+    n_tiles = couplings.N // S
+    # Every edge is oriented from the lower to the higher tile
+    a = np.minimum(couplings.edge_i, couplings.edge_j)
+    b = np.maximum(couplings.edge_i, couplings.edge_j)
+
+    inside = spins @ couplings.mu.reshape(n_tiles, S).T
+    W = np.zeros((n_tiles, n_tiles, S, S))
+    np.add.at(W, (a // S, b // S, a % S, b % S), couplings.edge_w)
+    for r in range(n_tiles):
+        inside[:, r] += np.einsum("va,ab,vb->v", spins, W[r, r], spins)
+    pairs = {(r, q): (spins @ W[r, q] @ spins.T).ravel()
+             for r in range(n_tiles) for q in range(r + 1, n_tiles) if W[r, q].any()}
+    return inside.T, pairs, spins.sum(axis=1)
+
+
+def symmetric_averages(couplings: Couplings, T: float, perms=None, inversion=None, block_bits: int = 16):
+    """
+    Compute average energy, magnetization, heat capacity, and
+    magnetic susceptibility by enumerating few states per symmetry orbit
+
+    States are integers with bit i the spin of site i, split into tiles of
+    S consecutive bits. Only states whose top tile t is no larger than the
+    top tile of any of their images under the group are enumerated; for the
+    group elements that move a whole tile to the top this bounds every
+    tile by t, so the states are built tile by tile from lookup tables. The
+    n states of an orbit that have the smallest top tile are found by the
+    same tables, and each is weighted by |orbit| / n = |G| / (number of
+    elements g with top tile of g(x) equal to t). The group is formed by
+    the site permutations and, with `inversion`, their composition with
+    flipping all spins, in which case <M> = 0 exactly.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    T           : float
+        temperature to compute at
+    perms       : list[array_like], optional
+        site permutations of the group except the identity, each an
+        automorphism of the couplings, found by find_symmetries by default
+    inversion   : bool, optional
+        include spin inversion, found by find_symmetries by default
+    block_bits  : int
+        log2 of the number of states handled in each vectorized block
+
+    Returns
+    -------
+    E  : float
+        Average energy of the hamiltonian
+    M  : float
+        Average magnetization of the hamiltonian
+    HC  : float
+        Average heat capacity of the hamiltonian
+    MS  : float
+        Average magnetic susceptibility of the hamiltonian
+    """
+    N = couplings.N
+    elements, inversion = _group(couplings, perms, inversion)
+    count, S, tables, others, tops = _tile_size(N, elements)
+    full = (1 << N) - 1
+
+    beta = 1 / T
+    values = np.arange(2 ** S, dtype=np.int64)
+    step = 2 ** block_bits
+    partials = []
+    inside, pairs, tile_mags = _tile_energies(couplings, S)
+    for t in tops.tolist():
+        # Tiles that no element moves to the top are free, the others must not map below t
+        alphabets = [values[table.min(axis=0) >= t] if len(table) else values for table in tables[:-1]]
+        matches = [(table[:, alphabet] == t).sum(axis=0) for table, alphabet in zip(tables, alphabets)]
+        top_matches = (tables[-1][:, t] == t).sum()
+        count = int(np.prod([len(alphabet) for alphabet in alphabets]))
+
+        for start in range(0, count, step):
+            index = np.arange(start, min(start + step, count), dtype=np.int64)
+            tiles = []
+            n = np.full(len(index), top_matches)
+            for alphabet, match in zip(alphabets, matches):
+                digit = index % len(alphabet)
+                tiles.append(alphabet[digit])
+                n += match[digit]
+                index //= len(alphabet)
+            tiles.append(np.full(len(n), t))
+
+            if others:
+                states = np.zeros(len(n), dtype=np.int64)
+                for r, tile in enumerate(tiles):
+                    states |= tile << (r * S)
+                keep = np.ones(len(n), dtype=bool)
+                for shifts, flip in others:
+                    image = _apply(states, shifts, flip, full) >> (N - S)
+                    keep &= image >= t
+                    n += image == t
+                tiles, n = [tile[keep] for tile in tiles], n[keep]
+                if len(n) == 0:
+                    continue
+
+            energies = sum(inside[r][tile] for r, tile in enumerate(tiles))
+            for (r, q), table in pairs.items():
+                energies += table[(tiles[r] << S) | tiles[q]]
+            mags = sum(tile_mags[tile] for tile in tiles)
+            partials.append(block_moments(energies, mags, beta, len(elements) / n))
+
+    logZ, E, EE, M, MM = merge_moments(partials)
+    if inversion:
+        M = 0.0
+
+    HC = (EE - E ** 2) * (T ** -2)
+    MS = (MM - M ** 2) * (T ** -1)
+
+    return E, M, HC, MS
@@ -3,7 +3,11 @@ Unit and regression test for the energy_package package.
 """
 
 # Import package, test suite, and other packages as needed
+import contextlib
+import io
 import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
@@ -115,15 +119,714 @@ def test_magnetization():
     ham = ep.IsingHamiltonian(G)
     
     assert(ham.magnetization(bit1) == -2)
+
+
+def make_ring(N, Jval=2.0):
+    """Build a ring graph with uniform couplings Jval"""
+    G = nx.Graph()
+    G.add_nodes_from([i for i in range(N)])
+    G.add_edges_from([(i,(i+1)% G.number_of_nodes() ) for i in range(N)])
+    for e in G.edges:
+        G.edges[e]['weight'] = Jval
+    return G
+
+
+def test_delta_e_matches_energy():
+    """Test delta_e() agrees with energy() differences when mu is set"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N))
+    ham.set_mu(np.array([.1*i for i in range(N)]))
+    
+    conf = ep.BitString(N)
+    conf.set_integer_config(11)
+    for i in range(N):
+        e0 = ham.energy(conf)
+        delta = ham.delta_e(conf, i)
+        conf.flip_site(i)
+        assert(np.isclose(ham.energy(conf) - e0, delta))
+
+
+def test_couplings_invalidation():
+    """Test compiled couplings are rebuilt when mu or G change"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N))
+    conf = ep.BitString(N)
+    conf.flip_site(2)
+    conf.flip_site(3)
+    assert(np.isclose(ham.energy(conf), 4.0))
     
+    ham.set_mu(np.array([.1 for i in range(N)]))
+    assert(np.isclose(ham.energy(conf), 3.8))
+    
+    ham.G = make_ring(N, 1.0)
+    assert(np.isclose(ham.energy(conf), 1.8))
+    
+    ham.G.edges[(0, 1)]['weight'] = 2.0
+    ham.invalidate()
+    assert(np.isclose(ham.energy(conf), 2.8))
+
+
+def test_gray_enumeration():
+    """Test Gray-code enumeration against a direct loop over all states"""
+    N = 8
+    G = nx.gnm_random_graph(N, 14, seed=1)
+    for k, e in enumerate(G.edges):
+        G.edges[e]['weight'] = (-1)**k * (1 + .1*k)
+    ham = ep.IsingHamiltonian(G)
+    ham.set_mu(np.array([.3 - .1*i for i in range(N)]))
+    
+    T = .8
+    conf = ep.BitString(N)
+    energies = []
+    mags = []
+    for i in range(2**N):
+        conf.set_integer_config(i)
+        energies.append(ham.energy(conf))
+        mags.append(ham.magnetization(conf))
+    energies = np.array(energies)
+    mags = np.array(mags)
+    weights = np.exp(-(energies - energies.min())/T)
+    weights /= weights.sum()
+    E = weights @ energies
+    M = weights @ mags
+    
+    for block_bits in [0, 3, N]:
+        E2, M2, HC2, MS2 = ep.exact_averages(ham.couplings, T, block_bits)
+        assert(np.isclose(E2, E))
+        assert(np.isclose(M2, M))
+        assert(np.isclose(HC2, (weights @ energies**2 - E**2)/T**2))
+        assert(np.isclose(MS2, (weights @ mags**2 - M**2)/T))
+
+
+def test_sweep_average_values():
+    """Test density of states reweighting against compute_average_values()"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N))
+    Ts = np.array([.05, 1, 3])
     
+    E, M, HC, MS = ham.sweep_average_values(Ts)
+    assert(np.isclose(E[1],  -11.95991923))
+    assert(np.isclose(HC[1],   0.31925472))
+    assert(np.isclose(MS[1],   0.01202961))
+    assert(np.all(np.isfinite(E)))
     
+    E, M, HC, MS = ham.sweep_average_values(Ts, .2)
+    ham.set_mu(np.array([.2 for i in range(N)]))
+    for i in range(len(Ts)):
+        assert(np.allclose([E[i], M[i], HC[i], MS[i]], ham.compute_average_values(Ts[i])))
+    assert(np.isclose(ham.density_of_states().counts.sum(), 2**N))
+
+
+def test_parallel_average():
+    """Test process pool enumeration matches the serial path"""
+    N = 10
+    ham = ep.IsingHamiltonian(make_ring(N, -1.0))
+    ham.set_mu(np.array([.1*i for i in range(N)]))
     
+    serial = ep.exact_averages(ham.couplings, 1.5, block_bits=4)
+    parallel = ep.exact_averages(ham.couplings, 1.5, block_bits=4, n_workers=2, chunk_size=48)
+    assert(np.allclose(serial, parallel))
 
+    # The serial path keeps no module state, so threads enumerating different couplings do not interfere
+    other = ep.IsingHamiltonian(make_ring(N, 1.0))
+    with ThreadPoolExecutor(2) as pool:
+        results = list(pool.map(lambda h: ep.exact_averages(h.couplings, 1.5, block_bits=4), [ham, other] * 4))
+    assert(all(np.allclose(r, serial) for r in results[::2]))
+    assert(all(np.allclose(r, ep.exact_averages(other.couplings, 1.5, block_bits=4)) for r in results[1::2]))
 
+
+def test_bitstr_packed():
+    """Test bitstring operations across word boundaries"""
+    N = 70
+    bits = [(i*7) % 3 % 2 for i in range(N)]
+    bit1 = ep.BitString(N).set_config(bits)
+    bit2 = ep.BitString(N).set_integer_config(int("".join(str(b) for b in bits), 2))
+    assert(bit1 == bit2)
+    assert(bit1.on() == sum(bits))
+    assert(bit1.off() == N - sum(bits))
     
+    bit1.flip_site(0)
+    bit1.flip_site(69)
+    bits[0] ^= 1
+    bits[69] ^= 1
+    assert(list(bit1.config) == bits)
+    assert(bit1.integer() == int("".join(str(b) for b in bits), 2))
     
+    bit3 = ep.BitString(5).set_config([1,0,0,1,1])
+    assert(bit3.integer() == 19)
+
+    # Sites outside [-N, N) would flip padding bits of the packed words
+    for i in [5, -6, 64]:
+        with pytest.raises(IndexError):
+            bit3.flip_site(i)
+    assert(bit3.flip_site(-5).integer() == 3 and bit3.on() == 2)
 
+
+def test_batch():
+    """Test energy_batch() and magnetization_batch() against single configurations"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N))
+    ham.set_mu(np.array([.1*i for i in range(N)]))
     
+    batch = ep.StateBatch.from_integers(np.arange(2**N), N)
+    energies = ham.energy_batch(batch)
+    mags = ham.magnetization_batch(batch.configs)
+    assert(len(batch) == 2**N)
     
+    conf = ep.BitString(N)
+    for i in range(2**N):
+        conf.set_integer_config(i)
+        assert(batch[i] == conf)
+        assert(np.isclose(energies[i], ham.energy(conf)))
+        assert(mags[i] == ham.magnetization(conf))
+
+
+def test_montecarlo_tracking():
+    """Test incrementally tracked observables match full recomputation"""
+    N = 8
+    ham = ep.IsingHamiltonian(make_ring(N, -1.0))
+    ham.set_mu(np.array([.3 for i in range(N)]))
+    
+    E, M = ep.MonteCarlo(ham, seed=2).run(1.5, 40, 10)
+    E2, M2 = ep.MonteCarlo(ham, seed=2).run(1.5, 40, 10, recompute_every=1)
+    assert(len(E) == 30)
+    assert(np.allclose(E, E2))
+    assert(M == M2)
+
+
+def test_checkerboard():
+    """Test checkerboard sweeps sample the exact averages"""
+    N = 7
+    ham = ep.IsingHamiltonian(make_ring(N, 1.0))
+    ham.set_mu(np.array([.3 for i in range(N)]))
+    
+    colors = ham.couplings.coloring()
+    for i in range(N):
+        assert(colors[i] != colors[(i+1) % N])
+    
+    E, M = ep.MonteCarlo(ham, seed=1).run(2.0, 10000, 500, recompute_every=100, mode="checkerboard")
+    E_exact, M_exact, HC, MS = ham.compute_average_values(2.0)
+    assert(np.isclose(np.mean(E), E_exact, atol=.1))
+    assert(np.isclose(np.mean(M), M_exact, atol=.1))
+
+
+def test_run_chains():
+    """Test seeded independent chains are reproducible and agree with each other"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N))
+    
+    res = ep.MonteCarlo(ham, seed=5).run_chains(3.0, 300, 50, n_chains=3)
+    res2 = ep.MonteCarlo(ham, seed=5).run_chains(3.0, 300, 50, n_chains=3, n_workers=2)
+    assert(res.E.shape == (3, 250))
+    assert(np.array_equal(res.E, res2.E))
+    assert(not np.array_equal(res.E[0], res.E[1]))
+    assert(np.isclose(res.mean_E, res.E.mean()))
+    assert(res.rhat_E < 1.1)
+    assert(res.stderr_M > 0)
+
+
+def test_tempering():
+    """Test parallel tempering samples the exact averages at every temperature"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N, 1.0))
+    ham.set_mu(np.array([.2 for i in range(N)]))
+    Ts = [1.0, 1.5, 2.2, 3.0]
+    
+    res = ep.MonteCarlo(ham, seed=3).run_tempering(Ts, 4000, 500, mode="checkerboard")
+    assert(res.E.shape == (4, 3500))
+    assert(np.all(res.swap_acceptance > 0))
+    for k in range(len(Ts)):
+        E, M, HC, MS = ham.compute_average_values(res.temperatures[k])
+        assert(np.isclose(res.mean_E[k], E, atol=.15))
+        assert(np.isclose(res.mean_M[k], M, atol=.15))
+    
+    res = ep.MonteCarlo(ham, seed=3).run_tempering([.5, .6, 2.0, 3.0], 400, 300, adapt=True)
+    assert(np.isclose(res.temperatures[0], .5))
+    assert(np.isclose(res.temperatures[-1], 3.0))
+    assert(np.all(np.diff(res.temperatures) > 0))
+
+    # Every ladder change visits new temperatures, the acceptance tables of old ones are dropped
+    for lattice in [ep.IsingHamiltonian.from_lattice((4, 4), J=-1.0), ep.LatticeHamiltonian((4, 4), J=-1.0)]:
+        ep.MonteCarlo(lattice, seed=1).run_tempering([.5, .8, 1.2, 2.0, 3.0], 600, 500,
+                                                     mode="checkerboard", adapt=True)
+        tables = lattice._tables if isinstance(lattice, ep.LatticeHamiltonian) else lattice.couplings._tables
+        assert(len(tables) == ep.couplings._MAX_TABLES)
+
+    # A burn-in as long as the run leaves empty traces, whose means are nan without warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        res = ep.MonteCarlo(ham, seed=3).run_tempering(Ts, 100, 100)
+    assert(res.E.shape == (4, 0))
+    assert(np.all(np.isnan(res.mean_E)) and np.all(np.isnan(res.mean_M)))
+
+
+def test_cluster_updates():
+    """Test Wolff and Swendsen-Wang updates sample the exact averages"""
+    labels = ep.union_find(6, np.array([0, 4, 2]), np.array([1, 5, 1]))
+    assert(list(labels) == [0, 0, 0, 3, 4, 4])
+    
+    G = nx.grid_2d_graph(3, 3, periodic=True)
+    for e in G.edges:
+        G.edges[e]['weight'] = -1.0
+    ham = ep.IsingHamiltonian(G)
+    ham.set_mu(np.array([.3 for i in range(9)]))
+    E_exact, M_exact, HC, MS = ham.compute_average_values(2.5)
+    
+    for mode in ["wolff", "swendsen-wang"]:
+        E, M = ep.MonteCarlo(ham, seed=4).run(2.5, 8000, 200, recompute_every=1000, mode=mode)
+        assert(np.isclose(np.mean(E), E_exact, atol=.3))
+        assert(np.isclose(np.mean(M), M_exact, atol=.3))
+
+
+def test_streaming():
+    """Test streaming accumulators and the sample generator agree with run() lists"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N))
+    ham.set_mu(np.array([.1 for i in range(N)]))
+    
+    E, M = ep.MonteCarlo(ham, seed=7).run(2.0, 3000, 100, thin=2)
+    stats = ep.MonteCarlo(ham, seed=7).run(2.0, 3000, 100, thin=2, stream=True)
+    batches = list(ep.MonteCarlo(ham, seed=7).iter_samples(2.0, 3000, 100, batch_size=400, thin=2))
+    assert(len(E) == 1450)
+    assert(stats.count == len(E))
+    assert([len(b[0]) for b in batches] == [400, 400, 400, 250])
+    assert(np.allclose(np.concatenate([b[0] for b in batches]), E))
+    
+    E_avg, M_avg, HC, MS = stats.averages()
+    assert(np.isclose(E_avg, np.mean(E)))
+    assert(np.isclose(M_avg, np.mean(M)))
+    assert(np.isclose(HC, np.var(E) / 4))
+    assert(np.isclose(MS, np.var(M) / 2))
+    assert(np.isclose(stats.abs_M.mean, np.mean(np.abs(M))))
+    dE, dM = stats.errors()
+    assert(dE > np.std(E) / np.sqrt(len(E)) / 2)
+
+    # A run that keeps no samples has no averages rather than an error
+    empty = ep.MonteCarlo(ham, seed=7).run(2.0, 100, 100, stream=True)
+    assert(empty.count == 0 and np.all(np.isnan(empty.averages())))
+
+
+def test_acceptance_table():
+    """Test discrete flip energies are detected and tabulated"""
+    N = 6
+    ham = ep.IsingHamiltonian(make_ring(N))
+    ham.set_mu(np.array([.5 for i in range(N)]))
+    q, K, acceptance = ham.couplings.acceptance_table(2.0)
+    assert(np.isclose(q, .5))
+    assert(K == 9)
+    
+    conf = ep.BitString(N)
+    conf.set_integer_config(13)
+    for i in range(N):
+        delta = ham.delta_e(conf, i)
+        k = int(round(-delta / (2*q)))
+        assert(np.isclose(acceptance[k + K], min(1, np.exp(-delta / 2.0))))
+    
+    ham.G.edges[(0, 1)]['weight'] = np.sqrt(2)
+    ham.invalidate()
+    assert(ham.couplings.acceptance_table(2.0) is None)
+
+
+def test_random_blocks():
+    """Test pre-drawn random blocks reproduce the generator stream"""
+    blocks = ep.RandomBlocks(np.random.default_rng(0), block_size=8)
+    draws = np.concatenate([blocks(3), [blocks()], blocks(4)])
+    assert(np.allclose(draws, np.random.default_rng(0).random(8)))
+    assert(len(blocks(5)) == 5)
+    assert(len(blocks(20)) == 20)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_kernel_backends(backend):
+    """Test every kernel backend reproduces the exact averages and Monte Carlo chain"""
+    if backend not in ep.available_backends():
+        pytest.skip("numba is not installed")
+    
+    N = 8
+    ham = ep.IsingHamiltonian(make_ring(N))
+    ham.set_mu(np.array([.1*i for i in range(N)]))
+    
+    previous = ep.get_backend()
+    try:
+        ep.set_backend("numpy")
+        E_ref = ep.MonteCarlo(ham, seed=1).run(1.5, 200, 0)[0]
+        ep.set_backend(backend)
+        E, M, HC, MS = ham.compute_average_values(1.5, method="enumerate")
+        E_mc = ep.MonteCarlo(ham, seed=1).run(1.5, 200, 0)[0]
+        assert(np.allclose(ep.exact_averages(ham.couplings, 1.5, block_bits=3), [E, M, HC, MS]))
+    finally:
+        ep.set_backend(previous)
+    
+    conf = ep.BitString(N)
+    energies = []
+    for i in range(2**N):
+        conf.set_integer_config(i)
+        energies.append(ham.energy(conf))
+    weights = np.exp(-(np.array(energies) - min(energies)) / 1.5)
+    assert(np.isclose(E, weights @ energies / weights.sum()))
+    assert(np.allclose(E_mc, E_ref))
+
+
+def test_observers():
+    """Test observers see the run progress and acceptance without changing the samples"""
+    ham = ep.IsingHamiltonian(make_ring(10))
+    E_ref, M_ref = ep.MonteCarlo(ham, seed=3).run(2.0, 300, 50)
+    
+    timing = ep.TimingObserver(every=100)
+    with pytest.raises(RuntimeError):
+        timing.profile()
+    stream = io.StringIO()
+    E, M = ep.MonteCarlo(ham, seed=3).run(2.0, 300, 50, observers=[timing, ep.ProgressObserver(150, stream)])
+    assert(E == E_ref and M == M_ref)
+    
+    assert([entry[0] for entry in timing.history] == [100, 200, 300])
+    assert(all(0 < entry[1] <= 1 for entry in timing.history))
+    assert(len(stream.getvalue().splitlines()) == 2)
+    profile = timing.profile()
+    assert(profile["proposal"] > 0 and profile["measurement"] >= 0)
+
+    # While the run is going the profile covers the sweeps so far
+    class Profile(ep.Observer):
+        def update(self, status):
+            self.profile = timing.profile()
+    timing, live = ep.TimingObserver(every=100), Profile(every=100)
+    ep.MonteCarlo(ham, seed=3).run(2.0, 300, 50, observers=[timing, live])
+    assert(0 < live.profile["proposal"] <= timing.profile()["proposal"])
+
+
+def test_checkpoint_resume(tmp_path):
+    """Test an interrupted run resumes from its checkpoint and writes the same samples"""
+    class Interrupt(ep.Observer):
+        def update(self, status):
+            raise KeyboardInterrupt
+    
+    ham = ep.IsingHamiltonian(make_ring(12))
+    ham.set_mu(np.array([.1*i for i in range(12)]))
+    kwargs = dict(checkpoint_every=100, store_configs=True, thin=2, mode="checkerboard")
+    
+    ref = ep.MonteCarlo(ham, seed=5).run_checkpointed(2.0, 500, 50, str(tmp_path / "ref.pkl"),
+                                                     output=str(tmp_path / "ref.npy"), **kwargs)
+    
+    path, output = str(tmp_path / "run.pkl"), str(tmp_path / "run.npy")
+    with pytest.raises(KeyboardInterrupt):
+        ep.MonteCarlo(ham, seed=5).run_checkpointed(2.0, 500, 50, path, output=output,
+                                                    observers=[Interrupt(every=250)], **kwargs)
+    assert(ep.Checkpoint.load(path).sweep == 200)
+    stats = ep.MonteCarlo(ham, seed=99).run_checkpointed(2.0, 500, 50, path, output=output, **kwargs)
+    
+    samples, ref_samples = np.load(output), np.load(str(tmp_path / "ref.npy"))
+    assert(len(samples) == 225 and stats.count == 225)
+    assert(np.allclose(samples["E"], ref_samples["E"]))
+    assert(np.array_equal(samples["M"], ref_samples["M"]))
+    assert(np.array_equal(samples["config"], ref_samples["config"]))
+    assert(np.allclose(stats.averages(), ref.averages()))
+    
+    spins = 2.0 * np.unpackbits(samples["config"], axis=1)[:, :12] - 1
+    assert(np.allclose(ham.couplings.energy_batch(spins), samples["E"]))
+    
+    with pytest.raises(ValueError):
+        ep.MonteCarlo(ham, seed=5).run_checkpointed(1.0, 500, 50, path, output=output, **kwargs)
+
+
+def test_autocorrelation():
+    """Test autocorrelation time, equilibration detection and adaptive stopping"""
+    rng = np.random.default_rng(0)
+    phi = .8
+    noise = rng.normal(size=200000)
+    x = np.zeros(len(noise))
+    for t in range(1, len(x)):
+        x[t] = phi * x[t-1] + noise[t]
+    assert(np.isclose(ep.integrated_autocorrelation_time(x), (1 + phi) / (1 - phi), rtol=.1))
+    assert(np.isclose(ep.effective_sample_size(noise), len(noise), rtol=.1))
+    
+    # A strictly alternating trace sums to a negative tau, it is floored at 1 so errors stay finite
+    alternating = np.tile([1.0, -1.0], 5000) + .01 * noise[:10000]
+    assert(ep.integrated_autocorrelation_time(alternating) == 1.0)
+    assert(ep.effective_sample_size(alternating) == len(alternating))
+    analysis = ep.SampleAnalysis(alternating, np.tile([1, -1], 5000), 2.0, n_burn=0)
+    assert(np.all(np.isfinite(analysis.errors)))
+    
+    trace = x[:20000] + 50 * np.exp(-np.arange(20000) / 200)
+    assert(1000 <= ep.detect_equilibration(trace) <= 4000)
+    
+    ham = ep.IsingHamiltonian(make_ring(8))
+    ham.set_mu(np.array([.1*i for i in range(8)]))
+    E, M, HC, MS = ham.compute_average_values(2.0)
+    analysis = ep.MonteCarlo(ham, seed=2).run_adaptive(2.0, (.05, .05, None, None), max_samples=100000)
+    assert(analysis.meets((.05, .05, None, None)))
+    assert(len(analysis.E) < 100000)
+    assert(abs(analysis.averages[0] - E) < 4 * analysis.errors[0])
+    assert(abs(analysis.averages[1] - M) < 4 * analysis.errors[1])
+    assert(abs(analysis.averages[2] - HC) < 4 * analysis.errors[2])
+
+    # Without samples there is nothing to analyse, and the targets are not met
+    analysis = ep.MonteCarlo(ham, seed=2).run_adaptive(2.0, (.05, .05, None, None), max_samples=0)
+    assert(np.all(np.isnan(analysis.averages)) and not analysis.meets((.05, .05, None, None)))
+
+
+def test_histogram_reweighting():
+    """Test single and multiple histogram reweighting against the exact averages"""
+    ham = ep.IsingHamiltonian(make_ring(10))
+    ham.set_mu(np.array([.1*i for i in range(10)]))
+    Ts = [1.5, 2.5, 4.0]
+    runs = [ep.MonteCarlo(ham, seed=k).run(T, 10000, 500, mode="checkerboard") for k, T in enumerate(Ts)]
+    
+    multi = ep.HistogramReweighting(Ts, [E for E, M in runs], [M for E, M in runs])
+    single = ep.HistogramReweighting(2.5, *runs[1])
+    assert(len(multi.overlap) == 2 and np.all(multi.overlap > .2))
+    dos = ham.density_of_states()
+    assert(np.allclose(multi.log_Z, dos.log_partition(Ts) - dos.log_partition(1.5), atol=.1))
+    
+    for rw, T in [(multi, 2.0), (multi, 3.0), (single, 2.2)]:
+        E, M, HC, MS = rw.averages(T)
+        E_ex, M_ex, HC_ex, MS_ex = ham.compute_average_values(T)
+        assert(abs(E - E_ex) < .3 and abs(M - M_ex) < .05 and abs(HC - HC_ex) < .3)
+    
+    assert(np.all(multi.reliable([1.5, 2.0, 4.0])))
+    assert(single.effective_samples(.3) < single.effective_samples(2.5))
+
+
+@pytest.mark.parametrize("n_walkers, n_workers", [(1, None), (2, 2)])
+def test_wang_landau(n_walkers, n_workers):
+    """Test the Wang-Landau density of states reproduces the exact thermodynamics"""
+    ham = ep.IsingHamiltonian(make_ring(10))
+    ham.set_mu(np.full(10, .5))
+    # The pure Python walk warns that it is slow
+    with pytest.warns(RuntimeWarning) if ep.kernels.numba is None else contextlib.nullcontext():
+        wl = ep.WangLandau(ham, seed=1).run(log_f_final=1e-4, n_walkers=n_walkers, n_workers=n_workers)
+    assert(np.isclose(ep.analysis._logsumexp(wl.log_g), 10 * np.log(2)))
+    
+    dos = ham.density_of_states()
+    for T in [.5, 2.0, 5.0]:
+        E, M, HC, MS = wl.averages(T)
+        E_ex, M_ex, HC_ex, MS_ex = ham.compute_average_values(T)
+        assert(abs(E - E_ex) < .3 and abs(M - M_ex) < .05 and abs(HC - HC_ex) < .3 and abs(MS - MS_ex) < .1)
+        assert(abs(wl.log_partition(T) - dos.log_partition(T)) < .2)
+
+    # In a field the fully magnetized states of a 2D lattice are only connected through high energies
+    ham = ep.IsingHamiltonian.from_lattice((3, 3), J=-1.0, mu=.3)
+    with pytest.warns(RuntimeWarning) if ep.kernels.numba is None else contextlib.nullcontext():
+        wl = ep.WangLandau(ham, seed=2).run(log_f_final=1e-4, n_walkers=n_walkers, n_workers=n_workers)
+    for T in [1.0, 3.0]:
+        exact = np.array(ham.compute_average_values(T))
+        assert(np.allclose(wl.averages(T), exact, rtol=.05, atol=.3))
+
+
+def test_array_constructors():
+    """Test hamiltonians built from edge arrays, sparse matrices and lattices match the graph ones"""
+    N = 8
+    mu = np.array([.1*i for i in range(N)])
+    ham = ep.IsingHamiltonian(make_ring(N)).set_mu(mu)
+    ring = ep.IsingHamiltonian.from_edges(N, np.arange(N), (np.arange(N) + 1) % N, 2.0, mu)
+    J = np.zeros((N, N))
+    J[np.arange(N), (np.arange(N) + 1) % N] = 2.0
+    sparse = ep.IsingHamiltonian.from_sparse(J + J.T, mu)
+    lattice = ep.IsingHamiltonian.from_lattice(N, 2.0, mu)
+    
+    batch = ep.StateBatch.from_integers(np.arange(2**N), N)
+    for other in [ring, sparse, lattice]:
+        assert(other._G is None)
+        assert(np.allclose(other.energy_batch(batch), ham.energy_batch(batch)))
+    assert(nx.utils.graphs_equal(ring.G, ham.G))
+    
+    grid = nx.convert_node_labels_to_integers(nx.grid_2d_graph(3, 4, periodic=True), ordering="sorted")
+    square = ep.IsingHamiltonian.from_lattice((3, 4), -1.0)
+    assert(len(square.couplings.edge_w) == grid.number_of_edges() == 24)
+    assert(sorted(map(sorted, grid.edges)) == sorted(map(sorted, zip(*ep.square_edges(3, 4)))))
+    assert(len(ep.hypercubic_edges((2, 2, 2))[0]) == 12)
+    assert(len(ep.hypercubic_edges((3, 3), periodic=False)[0]) == 12)
+
+
+def test_lattice_hamiltonian():
+    """Test the stencil lattice hamiltonian matches the generic one"""
+    mu = np.linspace(-.5, .5, 12)
+    for shape, periodic in [((3, 4), True), ((2, 3, 2), False), (12, True)]:
+        lattice = ep.LatticeHamiltonian(shape, -1.0, mu, periodic)
+        generic = ep.IsingHamiltonian.from_lattice(shape, -1.0, mu, periodic)
+        batch = ep.StateBatch.from_integers(np.arange(2**12), 12)
+        assert(np.allclose(lattice.energy_batch(batch), generic.energy_batch(batch)))
+        assert(np.isclose(lattice.energy(batch[5]), generic.energy(batch[5])))
+        assert(np.allclose(lattice.compute_average_values(2.0), generic.compute_average_values(2.0)))
+    
+    lattice = ep.LatticeHamiltonian((4, 4), 1.0, .5)
+    generic = ep.IsingHamiltonian.from_lattice((4, 4), 1.0, .5)
+    assert(lattice.sweep_function("checkerboard") == lattice.checkerboard_sweep)
+    E, M = ep.MonteCarlo(lattice, seed=4).run(2.0, 300, 0, mode="checkerboard")
+    E_ref, M_ref = ep.MonteCarlo(generic, seed=4).run(2.0, 300, 0, mode="checkerboard")
+    assert(np.allclose(E, E_ref) and M == M_ref)
+    assert(not ep.LatticeHamiltonian((3, 3)).bipartite)
+    
+    # Sublattice stencils in 3D with continuous fields, without building the couplings
+    mu = np.random.default_rng(0).normal(size=48)
+    lattice = ep.LatticeHamiltonian((4, 6, 2), -1.0, mu)
+    generic = ep.IsingHamiltonian.from_lattice((4, 6, 2), -1.0, mu)
+    E, M = ep.MonteCarlo(lattice, seed=4).run(2.0, 200, 0, mode="checkerboard")
+    assert(lattice._couplings is None)
+    E_ref, M_ref = ep.MonteCarlo(generic, seed=4).run(2.0, 200, 0, mode="checkerboard")
+    assert(np.allclose(E, E_ref) and M == M_ref)
+    
+    # On an open lattice with an odd last side the tracked changes match the stencil energy
+    lattice = ep.LatticeHamiltonian((3, 5), -1.0, mu[:15], periodic=False)
+    spins = -np.ones(15)
+    E, M = lattice.spin_energy(spins), -15
+    for k in range(20):
+        delta_e, delta_m, flipped = lattice.checkerboard_sweep(spins, 2.0)
+        E, M = E + delta_e, M + delta_m
+    assert(np.isclose(E, lattice.couplings.energy(spins)) and M == spins.sum())
+
+
+def test_transfer_matrix():
+    """Test transfer matrices against enumeration on chains, rings, strips and forests"""
+    rng = np.random.default_rng(0)
+    graphs = [make_ring(10), nx.path_graph(9), nx.convert_node_labels_to_integers(nx.grid_2d_graph(3, 5)),
+              nx.convert_node_labels_to_integers(nx.grid_2d_graph(4, 4, periodic=True)),
+              nx.disjoint_union(nx.path_graph(4), make_ring(5))]
+    for G in graphs:
+        for e in G.edges:
+            G.edges[e]['weight'] = rng.normal()
+        ham = ep.IsingHamiltonian(G).set_mu(rng.normal(size=len(G)))
+        for T in [.3, 2.0]:
+            assert(np.allclose(ham.compute_average_values(T, method="transfer"),
+                               ham.compute_average_values(T, method="enumerate")))
+    
+    assert([len(layer) for layer in ep.bfs_layers(ep.IsingHamiltonian(nx.path_graph(5)).couplings)] == [1]*5)
+    with pytest.raises(ValueError):
+        ep.transfer_matrix_averages(ham.couplings, 1.0, [[0], [2], [1] + list(range(3, len(G)))])
+    with pytest.raises(ValueError):
+        ham.compute_average_values(1.0, n_workers=2, method="transfer")
+    # A random tree has wide breadth-first layers, their matrices are refused before allocating
+    tree = ep.IsingHamiltonian(nx.random_labeled_tree(300, seed=1))
+    with pytest.raises(ValueError, match="sites wide"):
+        tree.compute_average_values(1.0, method="transfer")
+    
+    # A 1D ring in a field has a closed form through the eigenvalues of its 2x2 transfer matrix
+    N, J, h, T = 2000, -1.0, .3, 1.5
+    big = ep.IsingHamiltonian.from_lattice(N, J, h)
+    E, M, HC, MS = big.compute_average_values(T)
+    def log_lambda(beta):
+        K, B = -J * beta, -h * beta
+        return np.log(np.exp(K) * np.cosh(B) + np.sqrt(np.exp(2 * K) * np.sinh(B) ** 2 + np.exp(-2 * K)))
+    
+    eps = 1e-5
+    assert(np.isclose(E / N, -(log_lambda(1 / T + eps) - log_lambda(1 / T - eps)) / (2 * eps)))
+    assert(np.isclose(M / N, -np.sinh(h / T) / np.sqrt(np.sinh(h / T) ** 2 + np.exp(4 * J / T))))
+
+
+@pytest.mark.parametrize("heuristic", ["min-fill", "min-degree"])
+def test_variable_elimination(heuristic):
+    """Test variable elimination against enumeration, and on a tree too large to enumerate"""
+    rng = np.random.default_rng(1)
+    graphs = [make_ring(9), nx.convert_node_labels_to_integers(nx.grid_2d_graph(3, 4, periodic=True)),
+              nx.random_labeled_tree(12, seed=1), nx.complete_graph(6)]
+    for G in graphs:
+        for e in G.edges:
+            G.edges[e]['weight'] = rng.normal()
+        ham = ep.IsingHamiltonian(G).set_mu(rng.normal(size=len(G)))
+        for T in [.3, 2.0]:
+            assert(np.allclose(ep.elimination_averages(ham.couplings, T, heuristic=heuristic),
+                               ham.compute_average_values(T, method="enumerate")))
+    
+    # Without a field a tree factorizes over its edges: <E> = -sum_ij J_ij tanh(J_ij/T)
+    N, T = 300, 1.5
+    tree = nx.random_labeled_tree(N, seed=3)
+    J = rng.normal(size=N-1)
+    ham = ep.IsingHamiltonian.from_edges(N, *np.array(tree.edges).T, J)
+    order, width, cost = ep.elimination_order(ham.couplings, heuristic)
+    assert(width == 1 and sorted(order) == list(range(N)))
+    E, M, HC, MS = ham.compute_average_values(T)
+    assert(np.isclose(E, -np.sum(J * np.tanh(J / T))))
+    assert(np.isclose(HC, np.sum((J / T) ** 2 / np.cosh(J / T) ** 2)))
+    assert(np.isclose(M, 0) and np.isclose(MS, N / T, rtol=.5))
+
+
+def test_auto_prefers_transfer_on_rings(monkeypatch):
+    """Test auto solves a long ring by transfer matrices without estimating an elimination order"""
+    ham = ep.IsingHamiltonian.from_lattice(3000, J=-1.0, mu=.3)
+    expected = ham.compute_average_values(1.5, method="transfer")
+    order, width, cost = ep.elimination_order(ham.couplings)
+    assert(width == 2 and sorted(order) == list(range(ham.N)))
+    def fail(*args, **kwargs):
+        raise AssertionError("variable elimination used by auto")
+    monkeypatch.setattr(ep.functions, "elimination_order", fail)
+    monkeypatch.setattr(ep.functions, "elimination_averages", fail)
+    assert(np.allclose(ham.compute_average_values(1.5), expected))
+
+
+def test_symmetric_enumeration():
+    """Test orbit enumeration under translations and spin inversion against full enumeration"""
+    for shape, mu in [((12,), None), ((3, 4), None), ((4, 4), .2), ((2, 2, 3), None)]:
+        ham = ep.IsingHamiltonian.from_lattice(shape, J=-1.0, mu=mu)
+        perms, inversion = ep.find_symmetries(ham.couplings)
+        assert(len(perms) + 1 == ham.N and inversion == (mu is None))
+        assert(ep.symmetric_cost(ham.couplings) < 2 ** ham.N / 4)
+        for T in [.5, 2.0]:
+            assert(np.allclose(ham.compute_average_values(T, method="symmetric"),
+                               ham.compute_average_values(T, method="enumerate")))
+
+    # Random weights break the translations, a reflection of the ring is passed in by hand
+    ham = ep.IsingHamiltonian.from_lattice(10, J=-1.0, mu=.3)
+    reflection = -np.arange(10) % 10
+    assert(ep.is_automorphism(ham.couplings, reflection))
+    assert(np.allclose(ep.symmetric_averages(ham.couplings, 1.0, perms=[reflection], inversion=False),
+                       ham.compute_average_values(1.0, method="enumerate")))
+    G = make_ring(10)
+    for e in G.edges:
+        G.edges[e]['weight'] = np.random.default_rng(len(e)).normal() + e[0]
+    ham = ep.IsingHamiltonian(G)
+    assert(ep.find_symmetries(ham.couplings)[0] == [])
+    assert(not ep.is_automorphism(ham.couplings, reflection))
+    assert(np.allclose(ham.compute_average_values(1.0, method="symmetric"),
+                       ham.compute_average_values(1.0, method="enumerate")))
+
+
+def test_auto_skips_slow_symmetric(monkeypatch):
+    """Test auto does not pick orbit enumeration on rings and complete graphs, where it is slower"""
+    ring = ep.IsingHamiltonian(make_ring(20))
+    G = nx.complete_graph(20)
+    for e in G.edges:
+        G.edges[e]['weight'] = 1.0
+    complete = ep.IsingHamiltonian(G)
+    for ham in [ring, complete]:
+        # Fewer states than enumeration, but each costs many times more
+        assert(ep.symmetric_cost(ham.couplings) < 2 ** ham.N)
+        assert(ep.symmetric_cost(ham.couplings, weighted=True) > 2 ** ham.N)
+
+    # The lattice still gains from its orbits, the ring and complete graph never reach them
+    lattice = ep.IsingHamiltonian.from_lattice((4, 4), J=-1.0)
+    assert(ep.symmetric_cost(lattice.couplings, weighted=True) < 2 ** lattice.N)
+    expected = [ham.compute_average_values(1.0, method="enumerate") for ham in [ring, complete]]
+    def fail(*args, **kwargs):
+        raise AssertionError("symmetric enumeration picked by auto")
+    monkeypatch.setattr(ep.functions, "symmetric_averages", fail)
+    for ham, values in zip([ring, complete], expected):
+        assert(np.allclose(ham.compute_average_values(1.0), values))
+
+
+@pytest.mark.parametrize("mu", [np.zeros(4, dtype=int), np.zeros(4)])
+def test_couplings_copy_mu(mu):
+    """Test mu is a read-only copy, so in place edits raise instead of leaving the couplings stale"""
+    ham = ep.IsingHamiltonian(make_ring(4)).set_mu(mu)
+    bs = ep.BitString(4)
+    E = ham.energy(bs)
+    with pytest.raises(ValueError):
+        ham.mu[0] = 5
+    mu[0] = 5
+    assert(ham.energy(bs) == E)
+    ham.set_mu(mu)
+    assert(ham.energy(bs) == E - 5)
+
 
+def test_couplings_graph_edits():
+    """Test adding edges to G in place rebuilds the couplings, weight edits need invalidate"""
+    ham = ep.IsingHamiltonian(make_ring(4, 1.0))
+    bs = ep.BitString(4).set_integer_config(5)
+    assert(ham.energy(bs) == -4.0)
+    ham.G.edges[0, 1]['weight'] = 3
+    ham.G.add_edge(0, 2, weight=5)
+    assert(ham.energy(bs) == -1.0)
+    ham.G.edges[0, 2]['weight'] = 2
+    assert(ham.energy(bs) == -1.0)
+    ham.invalidate()
+    assert(ham.energy(bs) == -4.0)
+    ham.G.remove_edge(0, 2)
+    assert(ham.energy(bs) == -6.0)
@@ -0,0 +1,233 @@
+import numpy as np
+
+from .couplings import Couplings
+
+
+def _neighbors_of(couplings: Couplings, nodes):
+    """
+    Return the neighbors of a set of sites, with repeats
+    """
+    indptr = couplings.indptr
+    lengths = indptr[nodes + 1] - indptr[nodes]
+    entries = np.repeat(indptr[nodes] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return couplings.indices[entries]
+
+
+def _bfs_levels(couplings: Couplings, root: int):
+    """
+    Return the breadth-first levels of the component of `root`
+    """
+    seen = np.zeros(couplings.N, dtype=bool)
+    seen[root] = True
+    levels = [np.array([root])]
+    while True:
+        nbrs = np.unique(_neighbors_of(couplings, levels[-1]))
+        new = nbrs[~seen[nbrs]]
+        if len(new) == 0:
+            return levels
+        seen[new] = True
+        levels.append(new)
+
+
+def bfs_layers(couplings: Couplings):
+    """
+    Split the sites into layers coupled only to themselves and their neighboring layers
+
+    Each connected component is split into the breadth-first levels from a
+    pseudo-peripheral site (the last site reached from an arbitrary start),
+    which turns chains into layers of one site, rings into layers of two and
+    w-wide strips into layers of at most about w sites.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+
+    Returns
+    -------
+    layers : list[np.ndarray]
+        sites of every layer, every coupling joins sites of the same or consecutive layers
+    """
+    placed = np.zeros(couplings.N, dtype=bool)
+    layers = []
+    for root in range(couplings.N):
+        if placed[root]:
+            continue
+        far = _bfs_levels(couplings, root)[-1][0]
+        component = _bfs_levels(couplings, far)
+        for level in component:
+            placed[level] = True
+        layers.extend(component)
+    return layers
+
+
+def _layer_states(width: int):
+    """
+    Return the +1/-1 spins of all 2^width states of a layer, one state per row
+    """
+    states = np.arange(2 ** width)[:, None] >> np.arange(width)
+    return 2.0 * (states & 1) - 1
+
+
+def _check_layers(couplings: Couplings, layers):
+    """
+    Return the layer of every site, raising ValueError for layers that do not fit the couplings
+    """
+    layer_of = np.full(couplings.N, -1)
+    for k, sites in enumerate(layers):
+        layer_of[sites] = k
+    if (layer_of < 0).any() or sum(len(sites) for sites in layers) != couplings.N:
+        raise ValueError("layers must contain every site exactly once")
+    if np.any(np.abs(layer_of[couplings.edge_i] - layer_of[couplings.edge_j]) > 1):
+        raise ValueError("layers couple sites more than one layer apart")
+    return layer_of
+
+
+def _propagate(couplings: Couplings, layers, beta: float):
+    """
+    Return log Z, and the first and second derivatives of log Z with respect
+    to beta and to a uniform field h at h=0
+
+    Z is accumulated as a vector over the states of the current layer.
+    Every transfer factor F = exp(-beta u) is carried with its derivatives
+    F' = -g F and F'' = g^2 F, where g = u for beta and g = beta*M for h.
+    Energies are shifted by their minimum in every factor, the shifts are
+    added back at the end.
+    """
+    layer_of = _check_layers(couplings, layers)
+    position = np.zeros(couplings.N, dtype=np.int64)
+    for sites in layers:
+        position[sites] = np.arange(len(sites))
+
+    # Edges grouped by layer: key 2k inside layer k, 2k+1 between layers k and k+1
+    ei, ej, w = couplings.edge_i, couplings.edge_j, couplings.edge_w
+    swap = layer_of[ei] > layer_of[ej]
+    ei, ej = np.where(swap, ej, ei), np.where(swap, ei, ej)
+    key = 2 * layer_of[ei] + (layer_of[ei] != layer_of[ej])
+    order = np.argsort(key, kind="stable")
+    bounds = np.searchsorted(key[order], np.arange(2 * len(layers) + 1))
+    states = {}
+
+    log_scale = 0.0
+    shift = 0.0
+    prev_spins = None
+    for k, sites in enumerate(layers):
+        if len(sites) not in states:
+            states[len(sites)] = _layer_states(len(sites))
+        spins = states[len(sites)]
+
+        # Couplings inside the layer, and the field, are a factor on the states of the layer
+        inside = order[bounds[2 * k]:bounds[2 * k + 1]]
+        u = (spins[:, position[ei[inside]]] * spins[:, position[ej[inside]]]) @ w[inside] + spins @ couplings.mu[sites]
+        u0 = u.min()
+        shift += u0
+        u -= u0
+        F = np.exp(-beta * u)
+        m = beta * spins.sum(axis=1)
+
+        if k == 0:
+            # The first layer starts the vectors from its own factor alone
+            v, b1, b2, h1, h2 = F, -u * F, u * u * F, -m * F, m * m * F
+        else:
+            # Couplings to the previous layer are a matrix between the states of the two layers
+            between = order[bounds[2 * k - 1]:bounds[2 * k]]
+            J = np.zeros((len(layers[k - 1]), len(sites)))
+            np.add.at(J, (position[ei[between]], position[ej[between]]), w[between])
+            c = prev_spins @ J @ spins.T
+            c0 = c.min()
+            shift += c0
+            c -= c0
+            C = np.exp(-beta * c)
+            cC = c * C
+            v, b1, b2, h1, h2 = v @ C, b1 @ C - v @ cC, b2 @ C - 2 * (b1 @ cC) + v @ (c * cC), h1 @ C, h2 @ C
+            v, b1, b2, h1, h2 = (v * F, (b1 - u * v) * F, (b2 - 2 * u * b1 + u * u * v) * F,
+                                 (h1 - m * v) * F, (h2 - 2 * m * h1 + m * m * v) * F)
+        prev_spins = spins
+
+        scale = v.max()
+        v, b1, b2, h1, h2 = v / scale, b1 / scale, b2 / scale, h1 / scale, h2 / scale
+        log_scale += np.log(scale)
+
+    Z = v.sum()
+    log_Z = np.log(Z) + log_scale - beta * shift
+
+    # The shifts multiply Z by exp(-beta shift), which moves d log Z / d beta by -shift
+    d_beta = b1.sum() / Z - shift
+    d2_beta = b2.sum() / Z - (b1.sum() / Z) ** 2
+    d_h = h1.sum() / Z
+    d2_h = h2.sum() / Z - d_h ** 2
+    return log_Z, d_beta, d2_beta, d_h, d2_h
+
+
+def transfer_matrix_cost(layers):
+    """
+    Return the number of state pairs the transfer matrices of the layers contain
+
+    Parameters
+    ----------
+    layers  : list[np.ndarray]
+        sites of every layer
+
+    Returns
+    -------
+    cost : int
+        sum over consecutive layers of 2^(w_k + w_k+1)
+    """
+    widths = [len(sites) for sites in layers]
+    return sum(2 ** (a + b) for a, b in zip(widths[:-1], widths[1:])) + sum(2 ** a for a in widths)
+
+
+def transfer_matrix_averages(couplings: Couplings, T: float, layers=None, max_pairs: int = 2 ** 26):
+    """
+    Compute average energy, magnetization, heat capacity, and
+    magnetic susceptibility by transfer matrices
+
+    The sites are split into layers (see bfs_layers) and the partition
+    function is accumulated layer by layer, together with its derivatives
+    with respect to 1/T and to a uniform field. The cost is linear in the
+    number of layers and exponential only in their width, so chains, rings
+    and narrow strips of thousands of sites are solved exactly.
+
+    Parameters
+    ----------
+    couplings   : Couplings
+        compiled couplings of the hamiltonian
+    T           : float
+        temperature to compute at
+    layers      : list[np.ndarray], optional
+        sites of every layer, such that couplings only join the same or
+        consecutive layers, found by bfs_layers by default
+    max_pairs   : int
+        largest number of state pairs of a single transfer matrix, wider
+        layers raise ValueError instead of exhausting memory
+
+    Returns
+    -------
+    E  : float
+        Average energy
+    M  : float
+        Average magnetization
+    HC  : float
+        Heat capacity
+    MS  : float
+        Magnetic susceptibility
+    """
+    if layers is None:
+        layers = bfs_layers(couplings)
+    layers = [np.asarray(sites, dtype=np.int64) for sites in layers]
+    widths = [len(sites) for sites in layers]
+    largest = max([a + b for a, b in zip(widths[:-1], widths[1:])] + widths, default=0)
+    if 2 ** largest > max_pairs:
+        raise ValueError("transfer matrices are too large for layers up to " + str(max(widths))
+                         + " sites wide, use enumeration or variable elimination")
+    beta = 1 / T
+
+    # d log Z / d beta = -<E>, d^2 log Z / d beta^2 = var(E),
+    # d log Z / dh = -beta <M> and d^2 log Z / dh^2 = beta^2 var(M)
+    log_Z, d_beta, d2_beta, d_h, d2_h = _propagate(couplings, layers, beta)
+    E = -d_beta
+    M = -d_h / beta
+    HC = d2_beta * beta ** 2
+    MS = d2_h / beta
+
+    return E, M, HC, MS
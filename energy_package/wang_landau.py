@@ -0,0 +1,257 @@
+import warnings
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from . import kernels
+from .analysis import _logsumexp
+
+
+class WangLandauResults:
+    """
+    Class to hold a Wang-Landau density of states g(E) and the
+    microcanonical magnetization moments of every energy bin
+    """
+
+    def __init__(self, energies, log_g, mean_M, mean_MM, n_steps: int = 0):
+        """
+        Store the density of states
+
+        Parameters
+        ----------
+        energies    : np.ndarray
+            energy of every visited bin
+        log_g       : np.ndarray
+            log number of states in every bin, normalized to 2^N states in total
+        mean_M      : np.ndarray
+            average magnetization of the states in every bin
+        mean_MM     : np.ndarray
+            average squared magnetization of the states in every bin
+        n_steps     : int
+            number of single-flip steps taken
+        """
+        self.energies = np.asarray(energies, dtype=float)
+        self.log_g = np.asarray(log_g, dtype=float)
+        self.mean_M = np.asarray(mean_M, dtype=float)
+        self.mean_MM = np.asarray(mean_MM, dtype=float)
+        self.n_steps = n_steps
+
+    def _weights(self, T):
+        """
+        Return the normalized Boltzmann weights of the bins for every temperature
+        """
+        log_w = self.log_g - self.energies / np.asarray(T, dtype=float).reshape(-1, 1)
+        return np.exp(log_w - _logsumexp(log_w, axis=1)[:, None])
+
+    def log_partition(self, T):
+        """
+        Return the log partition function log Z
+
+        Parameters
+        ----------
+        T   : float or np.ndarray
+            temperatures to compute at
+
+        Returns
+        -------
+        logZ : float or np.ndarray
+            log partition function at every temperature
+        """
+        T = np.asarray(T, dtype=float)
+        return _logsumexp(self.log_g - self.energies / T.reshape(-1, 1), axis=1).reshape(T.shape)[()]
+
+    def averages(self, T):
+        """
+        Compute average energy, magnetization, heat capacity, and
+        magnetic susceptibility for an array of temperatures
+
+        Parameters
+        ----------
+        T   : float or np.ndarray
+            temperatures to compute at
+
+        Returns
+        -------
+        E  : float or np.ndarray
+            Average energy
+        M  : float or np.ndarray
+            Average magnetization
+        HC  : float or np.ndarray
+            Heat capacity
+        MS  : float or np.ndarray
+            Magnetic susceptibility
+        """
+        T = np.asarray(T, dtype=float)
+        weights = self._weights(T)
+        E = weights @ self.energies
+        M = weights @ self.mean_M
+        HC = (weights @ self.energies ** 2 - E ** 2) * T.ravel() ** -2
+        MS = (weights @ self.mean_MM - M ** 2) * T.ravel() ** -1
+        return tuple(x.reshape(T.shape)[()] for x in (E, M, HC, MS))
+
+
+class WangLandau:
+    """
+    Wang-Landau estimate of the density of states g(E) of an Ising hamiltonian
+
+    A random walk in configuration space accepts a flip from energy E to E'
+    with probability min(1, g(E)/g(E')) and raises log g of the current bin
+    by log f after every step, so that it spends equal time in every energy.
+    log f is halved whenever the histogram of visits is flat, and with
+    one_over_t the 1/t schedule of Belardinelli and Pereyra takes over once
+    log f falls below 1/t, which removes the saturation of the error of the
+    original method. All temperatures then follow from a single g(E).
+
+    The walk is inherently sequential, one flip at a time, and needs Numba
+    (`pip install -e .[numba]`) to be practical beyond a few dozen sites: the
+    pure Python fallback takes minutes for a 100 site ring that the compiled
+    kernel walks in about a second, and run warns when it is used.
+    """
+
+    def __init__(self, ham, seed=None, bin_width: float = None):
+        """
+        Set up the energy bins
+
+        When all couplings and fields are multiples of a unit q (see
+        Couplings.delta_unit) the energies of the single-flip walk are spaced
+        by 2q, and the bins are exactly the energy levels. Otherwise the
+        energy range is split into 4N bins, or bins of `bin_width`.
+
+        Parameters
+        ----------
+        ham         : IsingHamiltonian
+            hamiltonian to sample
+        seed        : int or np.random.SeedSequence, optional
+            seed of the random number generator, fresh entropy by default
+        bin_width   : float, optional
+            width of the energy bins, exact levels or 4N bins by default
+        """
+        self.ham = ham
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng = np.random.default_rng(seed)
+
+        couplings = ham.couplings
+        bound = np.abs(couplings.edge_w).sum() + np.abs(couplings.mu).sum()
+        self.spins = -np.ones(couplings.N)
+        e_start = couplings.energy(self.spins)
+
+        unit = couplings.delta_unit()
+        if bin_width is None:
+            bin_width = 2 * unit[0] if unit is not None else max(2 * bound, 1.0) / (4 * couplings.N)
+        self.width = bin_width
+
+        # Bin 0 is aligned so that the starting energy, and with exact levels every energy, is a bin center
+        below = int(np.ceil((e_start + bound) / self.width))
+        self.e_min = e_start - below * self.width
+        self.n_bins = below + int(np.ceil((bound - e_start) / self.width)) + 1
+
+    def run(self, log_f_final: float = 1e-6, flatness: float = .8, check_every: int = 10, one_over_t: bool = True,
+            n_walkers: int = 1, n_workers: int = None, max_sweeps: int = 10**7):
+        """
+        Estimate the density of states
+
+        With n_walkers > 1 independent walkers cover the whole energy range
+        (on a process pool with n_workers), and their log g are averaged,
+        which lowers the statistical error. The energy range is not split
+        into windows: a single-flip walker confined to a window cannot reach
+        the states of its edge bins that are only connected through energies
+        outside it, which biases g and the magnetization moments.
+
+        Parameters
+        ----------
+        log_f_final : float
+            stop once log f falls below this value
+        flatness    : float
+            histogram is flat when its smallest entry reaches this fraction of its mean
+        check_every : int
+            number of sweeps between flatness checks
+        one_over_t  : bool
+            switch to the 1/t schedule once log f falls below 1/t
+        n_walkers   : int
+            number of independent walkers
+        n_workers   : int, optional
+            number of worker processes, walkers run serially by default
+        max_sweeps  : int
+            largest number of sweeps of every walker
+
+        Returns
+        -------
+        results  : WangLandauResults
+            density of states and magnetization moments, normalized to 2^N states
+        """
+        settings = (log_f_final, flatness, check_every, one_over_t, max_sweeps)
+        N = self.ham.N
+        if kernels.numba is None:
+            warnings.warn("Numba is not installed, the Wang-Landau walk runs one Python step per flip "
+                          "and is slow beyond a few dozen sites", RuntimeWarning, stacklevel=2)
+
+        tasks = [(self.ham.couplings, self.spins.copy(), self.e_min, self.width, self.n_bins,
+                  np.random.default_rng(seed), settings)
+                 for seed in self.seed_sequence.spawn(n_walkers)]
+        if n_workers is None or n_workers <= 1:
+            pieces = [_walk(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(n_workers) as pool:
+                pieces = list(pool.map(_walk, tasks))
+
+        # Every walker's log g is normalized to 2^N states before the walkers that visited a bin are averaged
+        log_g = np.zeros(self.n_bins)
+        n_seen = np.zeros(self.n_bins)
+        visits, sum_m, sum_mm = np.zeros(self.n_bins), np.zeros(self.n_bins), np.zeros(self.n_bins)
+        for piece_g, piece_visits, piece_m, piece_mm, steps in pieces:
+            seen = piece_visits > 0
+            log_g[seen] += piece_g[seen] - _logsumexp(piece_g[seen])
+            n_seen += seen
+            visits += piece_visits
+            sum_m += piece_m
+            sum_mm += piece_mm
+
+        seen = visits > 0
+        log_g = log_g[seen] / n_seen[seen]
+        log_g += N * np.log(2) - _logsumexp(log_g)
+        energies = self.e_min + self.width * np.flatnonzero(seen)
+        return WangLandauResults(energies, log_g, sum_m[seen] / visits[seen], sum_mm[seen] / visits[seen],
+                                 sum(piece[4] for piece in pieces))
+
+
+def _walk(task):
+    """
+    Run one Wang-Landau walker over all energy bins, module level so it can be sent to worker processes
+
+    Returns the log g, visits, summed magnetization and squared magnetization
+    of every bin, and the number of steps taken.
+    """
+    couplings, spins, e_min, width, n_bins, rng, settings = task
+    log_f_final, flatness, check_every, one_over_t, max_sweeps = settings
+    N = couplings.N
+    histograms = tuple(np.zeros(n_bins) for k in range(5))
+    log_g, hist, visits = histograms[:3]
+
+    log_f = 1.0
+    schedule = False
+    steps = 0
+    for chunk in range(0, max_sweeps, check_every):
+        energy = couplings.energy(spins)
+        n = check_every * N
+        kernels.wang_landau_steps(couplings, spins, energy, spins.sum(), rng.integers(N, size=n), rng.random(n),
+                                  histograms, (e_min, width, 0, n_bins), log_f)
+        seen = visits > 0
+        if not seen.any():
+            continue
+        steps += n
+
+        t = steps / seen.sum()
+        if schedule:
+            log_f = 1 / t
+        elif hist[seen].min() >= flatness * hist[seen].mean():
+            log_f /= 2
+            hist[:] = 0
+            if one_over_t and log_f < 1 / t:
+                schedule = True
+                log_f = 1 / t
+        if log_f < log_f_final:
+            break
+
+    return log_g, visits, histograms[3], histograms[4], steps